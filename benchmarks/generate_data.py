@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+
+"""generate_data.py
+Generates synthetic variant analyser summary and frequency files for testing and benchmarking the haplotype analyser.
+The summary has the layout of the variant analyser output: for every variant on a tag one row with the variant ID,
+tier, tag and the in phase variants of that tag, one row for the second mate and an empty separator row.
+The frequency file holds the counts of the generated calls, so both files are consistent with each other.
+The output format (XLSX, TSV, CSV or Parquet) is taken from the file extension.
+With --DcsBam the calls are also written as a sorted and indexed DCS BAM (requires pysam): one pair of reads named
+after the tag which spans all variants of the tag on a chromosome. Both mates carry the alt allele for tiers 1.x,
+the second mate has an N for tiers 2.x and the ref allele for all other tiers. Every tenth pair also has a secondary
+record without a sequence and a supplementary record with the ref alleles, which the analyser must skip.
+USAGE: python generate_data.py --tags 100000 --variants 500 --SummaryFile summary.tsv --FreqFile frequency.tsv
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+
+def make_argparser():
+    parser = argparse.ArgumentParser(description='Generates synthetic variant analyser summary/frequency pairs')
+
+    parser.add_argument('--tags', type=int, default=10000, help='Number of tags (molecules) carrying a variant')
+    parser.add_argument('--variants', type=int, default=200, help='Number of variants')
+    parser.add_argument('--lengths', default='1:0.95,2:0.03,3:0.015,4:0.005',
+                        help='Distribution of the number of variants per tag as length:weight pairs')
+    parser.add_argument('--tiers', default='1.1:0.9,1.2:0.01,2.1:0.05,2.5:0.01,3.1:0.01,4:0.005,7:0.015',
+                        help='Tier mix of the calls as tier:weight pairs')
+    parser.add_argument('--afs', default='0.0005:0.85,0.005:0.08,0.05:0.03,0.5:0.03,1.0:0.01',
+                        help='Distribution of the variant allele frequencies as AF:weight pairs')
+    parser.add_argument('--window', type=int, default=8,
+                        help='Variants of a haplotype are at most this many variant positions apart')
+    parser.add_argument('--chromosomes', type=int, default=1, help='Number of chromosomes the variants lie on')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('-s', '--SummaryFile', required=True, help='Output summary file')
+    parser.add_argument('-f', '--FreqFile', required=True, help='Output frequency file')
+    parser.add_argument('--DcsBam', help='Output DCS BAM file with the reads of the calls')
+
+    return parser
+
+
+def parse_distribution(text):
+    values, weights = zip(*(pair.split(':') for pair in text.split(',')))
+    weights = np.array(weights, dtype=float)
+    return np.array(values, dtype=float), weights / weights.sum()
+
+
+def generate(n_tags, n_variants, lengths='1:1', tiers='1.1:1', afs='0.001:1', window=8, chromosomes=1, seed=0):
+    rng = np.random.default_rng(seed)
+
+    # variants sorted by chromosome and position, so that neighbouring codes lie close together
+    chrom = np.sort(rng.integers(1, chromosomes + 1, n_variants))
+    position = 1000000 + np.cumsum(rng.integers(1, 300, n_variants))
+    bases = np.array(list('ACGT'))
+    ref = rng.integers(0, 4, n_variants)
+    alt = (ref + rng.integers(1, 4, n_variants)) % 4
+    variants = np.array(['chr{}-{}-{}-{}'.format(*fields) for fields in
+                         zip(chrom, position, bases[ref], bases[alt])], dtype=object)
+    af_values, af_weights = parse_distribution(afs)
+    target_af = rng.choice(af_values, size=n_variants, p=af_weights)
+
+    # every tag starts at a variant picked proportionally to its AF and carries the next ones within the window
+    letters = np.frombuffer(b'ACGT', dtype=np.uint8)
+    tags = np.unique(letters[rng.integers(0, 4, (n_tags, 24))].view('S24').ravel()).astype(str).astype(object)
+    rng.shuffle(tags)
+    length_values, length_weights = parse_distribution(lengths)
+    tag_lengths = rng.choice(length_values.astype(int), size=len(tags), p=length_weights)
+    start = rng.choice(n_variants, size=len(tags), p=target_af / target_af.sum())
+    entry_tag = np.repeat(np.arange(len(tags)), tag_lengths)
+    first = np.r_[0, np.cumsum(tag_lengths)[:-1]]
+    gaps = rng.integers(1, max(window // 2, 1) + 1, len(entry_tag))
+    gaps[first] = 0
+    offsets = np.cumsum(gaps) - np.repeat(np.cumsum(gaps)[first], tag_lengths)
+    entry_var = np.minimum(start[entry_tag] + np.minimum(offsets, window), n_variants - 1)
+    calls = pd.DataFrame({'tag': entry_tag, 'var': entry_var}).drop_duplicates()
+    tier_values, tier_weights = parse_distribution(tiers)
+    calls['tier'] = rng.choice(tier_values, size=len(calls), p=tier_weights)
+    calls = calls.sort_values(['var', 'tag'], kind='stable')
+
+    # the in phase column lists the other variants of the tag
+    haplotypes = calls.groupby('tag')['var'].agg(list)
+    in_phase = [', '.join(variants[other] for other in haplotypes[tag] if other != var) or np.nan
+                for tag, var in zip(calls['tag'], calls['var'])]
+
+    n_calls = len(calls)
+    summary = pd.DataFrame({'variant ID': np.empty(3 * n_calls, dtype=object),
+                            'tier': np.full(3 * n_calls, np.nan),
+                            'tag': np.empty(3 * n_calls, dtype=object),
+                            'mate': np.empty(3 * n_calls, dtype=object),
+                            'in phase': np.empty(3 * n_calls, dtype=object)})
+    summary.iloc[0::3, 0] = variants[calls['var'].to_numpy()]
+    summary.iloc[0::3, 1] = calls['tier'].to_numpy()
+    for mate_row, mate in [(0, 'ab1.ba2'), (1, 'ab2.ba1')]:
+        summary.iloc[mate_row::3, 2] = tags[calls['tag'].to_numpy()]
+        summary.iloc[mate_row::3, 3] = mate
+        summary.iloc[mate_row::3, 4] = in_phase
+    summary = summary.iloc[:-1]  # no separator after the last call
+
+    # frequencies consistent with the calls: the coverage is chosen so that the AF matches the target AF
+    good = calls['tier'] < 3
+    ac_all = np.bincount(calls['var'], minlength=n_variants)
+    ac_good = np.bincount(calls.loc[good, 'var'], minlength=n_variants)
+    cvrg = np.maximum(np.round(ac_all / target_af), ac_all).astype(np.int64)
+    cvrg_good = cvrg - (ac_all - ac_good)
+    frequency = pd.DataFrame({'variant ID': variants,
+                              'cvrg': cvrg,
+                              'AC alt (all tiers)': ac_all,
+                              'AF (all tiers)': ac_all / np.maximum(cvrg, 1),
+                              'cvrg (tiers 1.1-2.5)': cvrg_good,
+                              'AC alt (tiers 1.1-2.5)': ac_good,
+                              'AF (tiers 1.1-2.5)': ac_good / np.maximum(cvrg_good, 1)})
+    frequency = frequency[ac_all > 0]
+    return summary, frequency
+
+
+def write_table(df, path):
+    if path.endswith('.xlsx'):
+        df.to_excel(path, index=False)
+    elif path.endswith('.parquet'):
+        df.to_parquet(path, index=False)
+    else:
+        df.to_csv(path, sep=',' if path.endswith('.csv') else '\t', index=False)
+
+
+def write_dcs_bam(summary, path, flank=25):
+    import pysam  # only needed for the BAM output
+
+    calls = summary.iloc[0::3]
+    fields = calls['variant ID'].str.rsplit('-', n=3, expand=True)
+    calls = pd.DataFrame({'tag': calls['tag'].to_numpy(), 'tier': calls['tier'].to_numpy(),
+                          'chrom': fields[0].to_numpy(), 'position': fields[1].astype(int).to_numpy(),
+                          'ref': fields[2].to_numpy(), 'alt': fields[3].to_numpy()})
+    chromosomes = calls.groupby('chrom', sort=True)['position'].max() + flank + 1
+    header = pysam.AlignmentHeader.from_dict({'HD': {'VN': '1.6', 'SO': 'unsorted'},
+                                              'SQ': [{'SN': chrom, 'LN': int(length)}
+                                                     for chrom, length in chromosomes.items()]})
+    contigs = {chrom: num for num, chrom in enumerate(chromosomes.index)}
+
+    # one read pair per tag spanning all its variants (of a chromosome), all other bases are N. Every tenth pair
+    # also has a secondary record of the first mate without a sequence and a supplementary record of the second
+    # mate with the ref alleles, as aligners write them, which must not change the calls.
+    unsorted = path + '.unsorted.bam'
+    with pysam.AlignmentFile(unsorted, 'wb', header=header) as bam:
+        for num, ((tag, chrom), tag_calls) in enumerate(calls.groupby(['tag', 'chrom'], sort=False)):
+            start = max(tag_calls['position'].min() - 1 - flank, 0)
+            length = tag_calls['position'].max() + flank - start
+            offsets = (tag_calls['position'] - 1 - start).tolist()
+            mate_bases = [tag_calls['alt'].tolist(),
+                          [alt if tier < 2 else 'N' if tier < 3 else ref
+                           for alt, ref, tier in zip(tag_calls['alt'], tag_calls['ref'], tag_calls['tier'])]]
+            records = [(0x40, mate_bases[0]), (0x80 | 0x10, mate_bases[1])]
+            if num % 10 == 0:
+                records += [(0x40 | 0x100, None), (0x80 | 0x10 | 0x800, tag_calls['ref'].tolist())]
+            for flag, bases in records:
+                read = pysam.AlignedSegment(header)
+                read.query_name = tag
+                read.flag = 0x1 | flag
+                read.reference_id = contigs[chrom]
+                read.reference_start = start
+                read.mapping_quality = 60
+                read.cigarstring = '{}M'.format(length)
+                if bases is not None:
+                    sequence = ['N'] * length
+                    for offset, base in zip(offsets, bases):
+                        sequence[offset] = base
+                    read.query_sequence = ''.join(sequence)
+                    read.query_qualities = pysam.qualitystring_to_array('I' * length)
+                bam.write(read)
+    pysam.sort('-o', path, unsorted)
+    pysam.index(path)
+    os.remove(unsorted)
+
+
+def main(argv):
+    args = make_argparser().parse_args(argv[1:])
+    summary, frequency = generate(args.tags, args.variants, args.lengths, args.tiers, args.afs, args.window,
+                                  args.chromosomes, args.seed)
+    write_table(summary, args.SummaryFile)
+    write_table(frequency, args.FreqFile)
+    if args.DcsBam:
+        write_dcs_bam(summary, args.DcsBam)
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+"""run_benchmarks.py
+Scaling benchmark of the haplotype analyser stages on synthetic libraries of increasing size.
+For every size a summary/frequency pair is generated with generate_data.py, the stages of haplotype_analyser are
+timed in one pass and memory profiled in a second pass (the memory tracing slows the stages down),
+and the results are written as JSON so that runs of different revisions can be compared.
+USAGE: python run_benchmarks.py --sizes 10000,100000,1000000 --output benchmark.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+from generate_data import generate, write_table
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'tools'))
+import HaplotypeAnalysisV1 as ha  # noqa: E402
+
+
+def make_argparser():
+    parser = argparse.ArgumentParser(description='Times and memory profiles the haplotype analyser stages')
+
+    parser.add_argument('--sizes', default='10000,100000,1000000', help='Comma separated numbers of tags')
+    parser.add_argument('--variants', type=int, default=1000, help='Number of variants of every library')
+    parser.add_argument('--format', default='tsv', choices=['xlsx', 'tsv', 'csv', 'parquet'],
+                        help='Format of the generated input files')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--no-memory', dest='memory', action='store_false',
+                        help='Skip the memory profiling pass')
+    parser.add_argument('-o', '--output', default='benchmark.json', help='JSON file with the results')
+
+    return parser
+
+
+def profile_run(summary, frequency, outdir, memory):
+    # the stages are recorded by the profiler of haplotype_analyser
+    profiler = ha.StageProfiler(memory=memory)
+    try:
+        ha.haplotype_analyser(['HaplotypeAnalysisV1.py', '-s', summary, '-f', frequency,
+                               '--outputFile1', os.path.join(outdir, '1.xlsx'),
+                               '--outputFile2', os.path.join(outdir, '2.xlsx'),
+                               '--outputFile3', os.path.join(outdir, '3.xlsx')], profiler)
+    finally:
+        profiler.close()  # the timing pass of the next size must not run traced
+    return profiler.records
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv):
+    args = make_argparser().parse_args(argv[1:])
+    report = {'revision': git_revision(), 'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+              'python': platform.python_version(), 'pandas': pd.__version__, 'variants': args.variants,
+              'format': args.format, 'seed': args.seed, 'results': []}
+
+    for n_tags in [int(size) for size in args.sizes.split(',')]:
+        with tempfile.TemporaryDirectory() as tmp:
+            summary = os.path.join(tmp, 'summary.' + args.format)
+            frequency = os.path.join(tmp, 'frequency.' + args.format)
+            df_s, df_f = generate(n_tags, args.variants, lengths='1:0.95,2:0.03,3:0.015,4:0.005',
+                                  tiers='1.1:0.9,1.2:0.01,2.1:0.05,2.5:0.01,3.1:0.01,4:0.005,7:0.015',
+                                  afs='0.0005:0.85,0.005:0.08,0.05:0.03,0.5:0.03,1.0:0.01', seed=args.seed)
+            write_table(df_s, summary)
+            write_table(df_f, frequency)
+            del df_s, df_f
+
+            records = profile_run(summary, frequency, tmp, memory=False)
+            if args.memory:
+                peaks = {record['stage']: record['peak_mb'] for record in profile_run(summary, frequency, tmp, True)}
+                for record in records:
+                    record['peak_mb'] = peaks[record['stage']]
+
+        for record in records:
+            report['results'].append(dict(record, size=n_tags))
+            print('{:>9} tags  {:<24}{:>10.3f} s{:>12}'.format(
+                n_tags, record['stage'], record['seconds'],
+                '{:.1f} MB'.format(record['peak_mb']) if 'peak_mb' in record else ''), file=sys.stderr, flush=True)
+
+    with open(args.output, 'w') as handle:
+        json.dump(report, handle, indent=2)
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,45 @@
+"""test_dcs_bam.py
+The DCS BAM input must give the same haplotypes, tiers and updated frequencies as the summary it was generated from.
+The BAM is written by benchmarks/generate_data.py with the tiers limited to those which can be told from the DCS
+reads (1.1 both mates carry the alt allele, 2.1 only one mate covers the variant, 4 the mates disagree).
+USAGE: python -m pytest tests
+"""
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+pytest.importorskip('pysam')
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'tools'))
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+import HaplotypeAnalysisV1 as ha  # noqa: E402
+from generate_data import generate, write_dcs_bam  # noqa: E402
+
+
+@pytest.fixture(scope='module')
+def library(tmp_path_factory):
+    summary, frequency = generate(2000, 150, lengths='1:0.6,2:0.25,3:0.1,4:0.05', tiers='1.1:0.8,2.1:0.1,4:0.1',
+                                  afs='0.0005:0.7,0.005:0.15,0.05:0.1,0.8:0.05', chromosomes=2, seed=1)
+    bam = str(tmp_path_factory.mktemp('dcs') / 'dcs.bam')
+    write_dcs_bam(summary, bam)
+    return summary, frequency, bam
+
+
+def sheet_tiers(result, sheet):
+    # the tags are indexed in the order of the input, so the sheets are compared as sorted tables
+    return result.tiers(sheet).sort_values(['tag', 'variant ID']).reset_index(drop=True)
+
+
+@pytest.mark.parametrize('bam_processes', [1, 2])
+def test_dcs_bam_matches_summary(library, bam_processes):
+    summary, frequency, bam = library
+    expected = ha.analyse(summary, frequency)
+    result = ha.analyse(None, frequency, dcs_bam=bam, bam_processes=bam_processes)
+
+    assert expected.mask('All_tiers').any()
+    for sheet in ha.SHEET_NAMES:
+        pd.testing.assert_frame_equal(sheet_tiers(result, sheet), sheet_tiers(expected, sheet))
+    pd.testing.assert_frame_equal(result.frequencies.sort_index(), expected.frequencies.sort_index())
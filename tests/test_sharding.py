@@ -0,0 +1,51 @@
+"""test_sharding.py
+The sharded tag index and classification must give the same index, sheets and updated frequencies as the whole
+library, also for tags whose variants lie in different windows or on different chromosomes.
+USAGE: python -m pytest tests
+"""
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'tools'))
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+import HaplotypeAnalysisV1 as ha  # noqa: E402
+from generate_data import generate  # noqa: E402
+
+
+@pytest.fixture(scope='module')
+def library():
+    return generate(5000, 300, lengths='1:0.5,2:0.3,3:0.15,4:0.05', tiers='1.1:0.8,2.1:0.05,3.1:0.05,4:0.05,7:0.05',
+                    afs='0.0005:0.7,0.005:0.15,0.05:0.1,0.8:0.05', window=40, chromosomes=3, seed=2)
+
+
+def assert_same_analysis(result, expected):
+    for field in ha.TagIndex._fields:
+        np.testing.assert_array_equal(getattr(result.index, field), getattr(expected.index, field))
+    for sheet in ha.SHEET_NAMES:
+        np.testing.assert_array_equal(result.mask(sheet), expected.mask(sheet))
+    pd.testing.assert_frame_equal(result.frequencies, expected.frequencies)
+
+
+@pytest.mark.parametrize('window, processes', [(0, 1), (0, 2), (2000, 1), (100, 3)])
+def test_sharded_matches_whole_library(library, window, processes):
+    summary, frequency = library
+    expected = ha.analyse(summary, frequency)
+    assert ha.count_tags(expected.index, expected.mask('All_tiers')) > 0
+    assert_same_analysis(ha.analyse(summary, frequency, shard_window=window, shard_processes=processes), expected)
+
+
+def test_tags_spanning_shards(library):
+    summary, frequency = library
+    tag_codes = pd.factorize(summary['tag'])[0]
+    shards = ha.shard_rows(ha.read_summary(summary), tag_codes, 100)
+    assert len(shards) > 1
+    position = ha.variant_positions(summary['variant ID'])[1]
+    assert (pd.Series(position // 100).groupby(tag_codes).nunique() > 1).any()
+    # every tag is in one shard only, also when its variants lie in several windows
+    shard_tags = [set(tag_codes[rows]) for rows in shards]
+    assert sum(map(len, shard_tags)) == len(set.union(*shard_tags))
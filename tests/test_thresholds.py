@@ -0,0 +1,42 @@
+"""test_thresholds.py
+The frequency update only takes the filtered out calls of tiers 1.1-2.5 off the AC and cvrg of a variant, the only
+calls the frequency file counts, whatever the goodTier threshold.
+USAGE: python -m pytest tests
+"""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, os.path.join(ROOT, 'tools'))
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+import HaplotypeAnalysisV1 as ha  # noqa: E402
+from generate_data import generate  # noqa: E402
+
+
+@pytest.fixture(scope='module')
+def library():
+    return generate(5000, 200, lengths='1:0.5,2:0.3,3:0.15,4:0.05', tiers='1.1:0.6,2.1:0.1,3.1:0.2,4:0.05,7:0.05',
+                    afs='0.0005:0.7,0.005:0.15,0.05:0.1,0.8:0.05', seed=3)
+
+
+@pytest.mark.parametrize('good_tier', [3, 4, 8])
+def test_frequency_update_counts_tiers_1_to_2(library, good_tier):
+    summary, frequency = library
+    result = ha.analyse(summary, frequency, ha.Thresholds(switAF=0.6, goodTier=good_tier, lowFreqAF=0.01,
+                                                          maxLowFreq=2))
+    index, filtered_out = result.index, result.mask('lowfreq >1')
+    tiers = index.tier_values[index.tier_codes]
+    assert (filtered_out & (tiers > 2.5)).any() == (good_tier > 3)
+
+    counted = np.bincount(index.cols[filtered_out & (tiers <= 2.5)], minlength=len(index.variants))
+    original = frequency.set_index('variant ID').loc[result.frequencies.index]
+    updated = counted[np.searchsorted(index.variants, result.frequencies.index)]
+    np.testing.assert_array_equal(result.frequencies['AC alt (tiers 1.1-2.5)'],
+                                  original['AC alt (tiers 1.1-2.5)'] - updated)
+    np.testing.assert_array_equal(result.frequencies['cvrg (tiers 1.1-2.5)'],
+                                  original['cvrg (tiers 1.1-2.5)'] - updated)
+    assert (result.frequencies['AC alt (tiers 1.1-2.5)'] > 0).all()
+    assert result.frequencies['AF (tiers 1.1-2.5)'].between(0, 1).all()
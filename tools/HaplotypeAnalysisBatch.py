@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+
+"""HaplotypeAnalysisBatch.py
+Runs the haplotype analyser on many libraries in one invocation.
+The libraries are read from a tab separated manifest with one library per line:
+library name, summary file, frequency file and output prefix. Empty lines and lines starting with # are skipped.
+Every library is analysed in a worker process of a pool and writes
+<prefix>_HaplotypeAnalysis.xlsx, <prefix>_TierAnalysis.xlsx and <prefix>_NewFreq.xlsx
+(or .tsv/.parquet with --outputFormat).
+Options which are not recognised here (e.g. --cacheDir) are passed on to the analysis of every library.
+USAGE: python HaplotypeAnalysisBatch.py --manifest libraries.tsv --processes 4
+"""
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import argparse
+import sys
+import traceback
+
+from HaplotypeAnalysisV1 import OUTPUT_FORMATS, haplotype_analyser, output_files
+
+
+def make_argparser():
+    parser = argparse.ArgumentParser(description='Runs the haplotype analyser on all libraries of a manifest')
+
+    parser.add_argument('-m', '--manifest', type=str, required=True,
+                        help='Tab separated file with library name, summary file, frequency file, output prefix')
+    parser.add_argument('-p', '--processes', type=int, default=1,
+                        help='Number of libraries analysed at the same time')
+    parser.add_argument('--outputFormat', default='xlsx', choices=OUTPUT_FORMATS,
+                        help='Format of the output files, which are named after the prefix with this extension')
+
+    return parser
+
+
+def read_manifest(manifest):
+    libraries = []
+    with open(manifest) as handle:
+        for line_num, line in enumerate(handle, 1):
+            if not line.strip() or line.startswith('#'):
+                continue
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) != 4:
+                raise ValueError('{}:{}: expected 4 tab separated fields, found {}'.format(manifest, line_num,
+                                                                                          len(fields)))
+            libraries.append(fields)
+    return libraries
+
+
+def analyse_library(summary, frequency, prefix, passthrough, output_format='xlsx'):
+    outputs = output_files(prefix, output_format)
+    try:
+        haplotype_analyser(['HaplotypeAnalysisV1.py', '-s', summary, '-f', frequency,
+                            '--outputFile1', outputs[0], '--outputFile2', outputs[1], '--outputFile3', outputs[2],
+                            '--outputFormat', output_format] + passthrough)
+    except (Exception, SystemExit):  # SystemExit: invalid options of the analysis
+        # the traceback is formatted in the worker, as not every exception survives the way back from the pool
+        return traceback.format_exc()
+    return None
+
+
+def batch_analyser(argv):
+    parser = make_argparser()
+    args, passthrough = parser.parse_known_args(argv[1:])
+    libraries = read_manifest(args.manifest)
+
+    failed = []
+    with ProcessPoolExecutor(max_workers=args.processes) as executor:
+        futures = {executor.submit(analyse_library, summary, frequency, prefix, passthrough, args.outputFormat): library
+                   for library, summary, frequency, prefix in libraries}
+        for done, future in enumerate(as_completed(futures), 1):
+            library = futures[future]
+            try:
+                error = future.result()
+            except Exception:  # the worker process itself died
+                error = traceback.format_exc()
+            if error is None:
+                print('[{}/{}] {}: done'.format(done, len(libraries), library), file=sys.stderr, flush=True)
+            else:
+                failed.append(library)
+                print('[{}/{}] {}: FAILED\n{}'.format(done, len(libraries), library, error), file=sys.stderr,
+                      flush=True)
+
+    if failed:
+        print('{} of {} libraries failed: {}'.format(len(failed), len(libraries), ', '.join(failed)),
+              file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(batch_analyser(sys.argv))
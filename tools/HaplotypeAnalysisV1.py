@@ -12,385 +12,814 @@ Version  Date        Author             Description
 USAGE: python HaplotypeAnalyser.py --SummaryFile Variant analyser summary xlsx file --FreqFile Variant analyser
                                    variant's frequencies file --DcsBam DCS.bam
 """
-from collections import Counter
+from collections import namedtuple
+from itertools import chain, islice, repeat
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager, nullcontext
 import xlsxwriter
 import argparse
+import hashlib
+import json
+import numpy as np
+import os
 import pandas as pd
 import sys
+import time
+import tracemalloc
+
+# the only columns of the variant analyser files which are used, all others are never parsed
+SUMMARY_COLUMNS = ['variant ID', 'tier', 'tag', 'in phase']
+FREQUENCY_COLUMNS = ['variant ID', 'AF (all tiers)', 'cvrg (tiers 1.1-2.5)', 'AC alt (tiers 1.1-2.5)',
+                     'AF (tiers 1.1-2.5)']
+OUTPUT_FORMATS = ['xlsx', 'tsv', 'parquet']
+
+# the largest worksheet, the haplotype sheets have two header rows and the tag column
+EXCEL_MAX_ROWS = 1048576
+EXCEL_MAX_COLUMNS = 16384
 
 
 def make_argparser():
     parser = argparse.ArgumentParser(description='Finds haplotypes withing  a library, and classifies them based'
                                                  'on tiers. It also updates the allele frequencies of the variants')
 
-    parser.add_argument("-s", "--SummaryFile", type=str, required=True,
-                        help='XLSX summary file from the variant analyser')
+    parser.add_argument("-s", "--SummaryFile", type=str,
+                        help='Summary file from the variant analyser (XLSX, TSV, CSV or Parquet)')
     parser.add_argument("-f", "--FreqFile", type=str, required=True,
-                        help='XLSX variants frequencies file from the variant analyser')
+                        help='Variants frequencies file from the variant analyser (XLSX, TSV, CSV or Parquet)')
+    parser.add_argument('--DcsBam',
+                        help='Indexed DCS BAM file, read instead of the summary file. The alt alleles of the variants '
+                             'of the frequency file are taken from the reads, with the read names as tags.')
+    parser.add_argument('--bamProcesses', type=int, default=1,
+                        help='Number of regions of the DCS BAM read at the same time, each in its own process')
+    parser.add_argument('--cacheDir',
+                        help='Directory for a Parquet cache of the parsed input files, keyed by their content hash')
     parser.add_argument('--outputFile1',
                         help='Output xlsx file with extracted haplotypes Ref > Alt format')
     parser.add_argument('--outputFile2',
                         help='Output xlsx file with extracted haplotypes tier number format')
     parser.add_argument('--outputFile3',
                         help='Output xlsx file with updated allele frequencies for the original VF file')
+    parser.add_argument('--outputSummary',
+                        help='Output xlsx file with the distinct haplotypes of the All_tiers and lowfreq 0r1 sheets, '
+                             'their number of tags and tiers, and the number of tags carrying every variant pair')
+    parser.add_argument('--outputFormat', default='xlsx', choices=OUTPUT_FORMATS,
+                        help='Format of the three output files. tsv and parquet write the haplotype sheets as long '
+                             'tables with one row per tag and variant, xlsx sheets beyond the Excel limits are '
+                             'split into several worksheets.')
+    parser.add_argument('--concurrentOutput', action='store_true',
+                        help='Write the three output files concurrently, each in its own process')
+    parser.add_argument('--switAF', type=float, default=0.6,
+                        help='Variants of this AF (tiers 1.1-2.5) or higher are SNPS, removed from the haplotypes')
+    parser.add_argument('--goodTier', type=float, default=3,
+                        help='Variants of a tier below this one are of good tier')
+    parser.add_argument('--lowFreqAF', type=float, default=0.01,
+                        help='Variants of an AF (tiers 1.1-2.5) below this one are of low frequency')
+    parser.add_argument('--maxLowFreq', type=int, default=2,
+                        help='Good tier haplotypes with this many low frequency variants or more are filtered out')
+    parser.add_argument('--shardWindow', type=int,
+                        help='Build the tag index and classify the tags in shards: by chromosome (0) or by windows '
+                             'of this many bases of a chromosome. Every tag belongs to the shard of its first '
+                             'variant.')
+    parser.add_argument('--shardProcesses', type=int, default=1,
+                        help='Number of shards indexed and classified at the same time, each in its own process')
+    parser.add_argument('--sweep',
+                        help='Tab separated grid of threshold settings (columns switAF, goodTier, lowFreqAF, '
+                             'maxLowFreq and output) which are all evaluated against one index of the library. '
+                             'Missing values take the thresholds given on the command line, the three workbooks '
+                             'are only written for the settings with an output prefix.')
+    parser.add_argument('--sweepSummary',
+                        help='Output tsv file with the haplotype counts of every setting of --sweep')
+    parser.add_argument('--profile',
+                        help='Write the wall time, peak memory and sizes of every stage to this JSON or TSV file '
+                             '(the memory tracing slows the analysis down)')
 
     return parser
 
 
-def haplotype_analyser(argv):
-    same_molecule = True
-    parser = make_argparser()
-    args = parser.parse_args(argv[1:])
-    summary = args.SummaryFile
-    frequency = args.FreqFile
-    outfile1 = args.outputFile1
-    outfile2 = args.outputFile2
-    outfile3 = args.outputFile3
-
-    # noinspection PyArgumentList
-    df_s = pd.read_excel(summary)
-    df_s['variant ID'] = df_s['variant ID'].fillna(',')
-    df_s['in phase'] = df_s['in phase'].fillna(',')
-
-    # noinspection PyArgumentList
-    df_f = pd.read_excel(frequency, index_col=0)
-
-    variants_freq_all = {var: df_f.loc[var]['AF (all tiers)'] for var in df_f.index.tolist()}
-    variants_freq_gd = {var: df_f.loc[var]['AF (tiers 1.1-2.5)'] for var in df_f.index.tolist()}
-
-    # Obtain the variants from the summary file and their tiers respectively depending on the tag they are on
-    variants_tags_tier = {i: {} for i in df_s['variant ID']}
-    for row in df_s.index.tolist():
-        var = df_s.loc[row]['variant ID']
-        tag = df_s.loc[row]['tag']
-        tier = df_s.loc[row]['tier']
-        variants_tags_tier[var][tag] = tier
-    del variants_tags_tier[',']
-
-    # get the linkages of each tag (variant id + in phase variants )
-    # join in phase with variant ID and remove comas, white spaces
-    linkages = [i.replace(' ', ',') for i in df_s['in phase']]
-    linkages = [i + ',' + k for i, k in zip(linkages, df_s['variant ID'])]
-    linkages = [list(set(i.split(','))) for i in linkages]
-    df_s['linkages'] = linkages
-
-    # get tags in a dictionary
-    tags_haplotypes_all = {i: [] for i in df_s['tag']}
-    for row in df_s.index.tolist():
-        tag = df_s.loc[row]['tag']
-        haplotype = df_s.loc[row]['linkages']  # add linkages to each tag
-        tags_haplotypes_all[tag].append(haplotype)
-
-    for key in list(tags_haplotypes_all):  # remove nan key
-        if isinstance(key, float):
-            del tags_haplotypes_all[key]
-
-        # tags_haplotypes_all contains the tags with the haplotypes present on them and tags with only one variant
-        # ( same molecule filter is not applied yet)
-    tags_haplotypes_all = {tag: list(set(sum(tags_haplotypes_all[tag], []))) for tag in
-                           tags_haplotypes_all}  # flatten the lists and get rid of duplicates
-    tags_haplotypes_all = {tag: [var for var in tags_haplotypes_all[tag] if len(var) > 1] for tag in
-                           tags_haplotypes_all}  # remove '' from the lists
-
+class StageProfiler:
+    # Records wall time, peak traced memory and row/tag/variant counts of the stages of an analysis.
+    # Stages may be nested, the peak of a stage includes the peaks of the stages within it.
+    # close() stops the memory tracing again if the profiler started it, which slows everything down.
+    def __init__(self, memory=True):
+        self.memory = memory
+        self.records = []
+        self._peaks = []
+        self._tracing = False
+
+    @contextmanager
+    def stage(self, name):
+        record = {'stage': name}
+        if self.memory:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._tracing = True
+            if self._peaks:  # keep the peak the enclosing stage reached so far
+                self._peaks[-1] = max(self._peaks[-1], tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+            self._peaks.append(0)
+        start = time.perf_counter()
+        try:
+            yield record  # the stage adds its counts to the record
+        finally:
+            record['seconds'] = time.perf_counter() - start
+            if self.memory:
+                peak = max(self._peaks.pop(), tracemalloc.get_traced_memory()[1])
+                record['peak_mb'] = peak / 2 ** 20
+                if self._peaks:
+                    self._peaks[-1] = max(self._peaks[-1], peak)
+            self.records.append(record)
+
+    def close(self):
+        if self._tracing:
+            tracemalloc.stop()
+            self._tracing = False
+
+    def write(self, path):
+        if path.endswith('.json'):
+            with open(path, 'w') as handle:
+                json.dump(self.records, handle, indent=2)
+        else:
+            columns = ['stage', 'seconds', 'peak_mb', 'rows', 'tags', 'variants']
+            columns += [key for record in self.records for key in record if key not in columns]
+            with open(path, 'w') as handle:
+                handle.write('\t'.join(columns) + '\n')
+                for record in self.records:
+                    handle.write('\t'.join(str(record.get(column, '')) for column in columns) + '\n')
+
+
+def no_profile(name):
+    # stand-in for StageProfiler.stage when profiling is disabled
+    return nullcontext({})
+
+
+def input_format(path):
+    # Galaxy datasets have no meaningful extension, so the format is taken from the content of the file
+    with open(path, 'rb') as handle:
+        head = handle.read(4096)
+    if head.startswith(b'PK\x03\x04'):
+        return 'xlsx'
+    if head.startswith(b'PAR1'):
+        return 'parquet'
+    if b'\t' in head.split(b'\n', 1)[0]:
+        return 'tsv'
+    return 'csv'
+
+
+def input_digest(path, columns):
+    # the parser version is part of the digest, so that tables cached by an older parser are not reused
+    digest = hashlib.sha256('\t'.join(['round_trip'] + columns).encode())
+    with open(path, 'rb') as handle:
+        for chunk in iter(lambda: handle.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def read_table(path, columns, cache_dir=None):
+    file_format = input_format(path)
+    cache_file = None
+    if cache_dir and file_format != 'parquet':  # a re-run on the same input skips the parsing
+        cache_file = os.path.join(cache_dir, input_digest(path, columns) + '.parquet')
+        if os.path.exists(cache_file):
+            return pd.read_parquet(cache_file)
+
+    if file_format == 'xlsx':
+        # noinspection PyArgumentList
+        df = pd.read_excel(path, usecols=columns)
+    elif file_format == 'parquet':
+        df = pd.read_parquet(path, columns=columns)
+    else:
+        # the fast float parser of read_csv can be off in the last digit, round_trip gives the same values as the
+        # xlsx and Parquet inputs
+        df = pd.read_csv(path, sep='\t' if file_format == 'tsv' else ',', usecols=columns,
+                         float_precision='round_trip')
+
+    if cache_file:
+        os.makedirs(cache_dir, exist_ok=True)
+        temp_file = '{}.{}.tmp'.format(cache_file, os.getpid())  # concurrent runs never see a partial file
+        df.to_parquet(temp_file)
+        os.replace(temp_file, cache_file)
+    return df
+
+
+# Compact model of a library: tags and variants are interned once into integer codes, every (tag, variant) pair
+# found on the same molecule is one entry. The entries are sorted by tag code and then variant code, so the
+# haplotype of a tag is a sorted run of variant codes. Tag codes follow the first appearance of the tags in the
+# summary, variant codes the sorted variant IDs, and the tiers are small codes into tier_values.
+# The strings are only looked up again when the output is written.
+TagIndex = namedtuple('TagIndex', ['tags', 'variants', 'rows', 'cols', 'tier_codes', 'tier_values'])
+
+# the sheets of the output workbooks, in the order of the masks returned by classify_haplotypes
+SHEET_NAMES = ['All_tiers', 'Hap_1+', 'HapHQ', 'lowfreq 0r1', 'lowfreq >1', 'swit_haps']
+
+# suffixes of the three output files when they are named after a prefix (sweep and batch mode)
+OUTPUT_SUFFIXES = ['_HaplotypeAnalysis', '_TierAnalysis', '_NewFreq']
+
+# The thresholds of the classification: the AF from which a variant is a SNP, the tier below which a variant is of
+# good tier, the AF below which a variant is of low frequency and the number of low frequency variants from which a
+# good tier haplotype is filtered out.
+Thresholds = namedtuple('Thresholds', ['switAF', 'goodTier', 'lowFreqAF', 'maxLowFreq'])
+DEFAULT_THRESHOLDS = Thresholds(switAF=0.6, goodTier=3, lowFreqAF=0.01, maxLowFreq=2)
+
+
+def build_tag_index(df_s, same_molecule=True, stage=no_profile):
+    tag_codes, tags = pd.factorize(df_s['tag'])  # tags in order of first appearance, nan tags get -1
+
+    # the variants of the summary file and their tiers respectively depending on the tag they are on
+    is_call = (df_s['variant ID'] != ',').to_numpy() & (tag_codes >= 0)
+    call_tags = tag_codes[is_call]
+    call_vars = df_s['variant ID'].to_numpy()[is_call]
+    call_tiers = df_s['tier'].to_numpy()[is_call]
+
+    # get the linkages of each tag (variant id + in phase variants ), only the in phase column needs to be split
+    # at comas and white spaces
+    is_phased = (df_s['in phase'] != ',').to_numpy() & (tag_codes >= 0)
+    in_phase = df_s['in phase'][is_phased].str.replace(' ', ',').str.split(',')
+    lengths = in_phase.str.len().to_numpy()
+    link_tags = np.concatenate([call_tags, np.repeat(tag_codes[is_phased], lengths)])
+    link_vars = np.concatenate([call_vars, np.fromiter(chain.from_iterable(in_phase), dtype=object,
+                                                       count=lengths.sum())])
+    keep = (pd.Series(link_vars, dtype=object).str.len() > 1).to_numpy()  # remove '' variants
+    link_tags, link_vars = link_tags[keep], link_vars[keep]
+
+    var_codes, variants = pd.factorize(np.concatenate([call_vars, link_vars]), sort=True)
+    n_variants = max(len(variants), 1)
+    call_keys = call_tags.astype(np.int64) * n_variants + var_codes[:len(call_tags)]
+    link_keys = np.unique(link_tags.astype(np.int64) * n_variants + var_codes[len(call_tags):])
+
+    # the last row of a variant/tag pair wins, as when the rows were assigned one by one
+    call_keys, last = np.unique(call_keys[::-1], return_index=True)
+    call_tiers = call_tiers[::-1][last]
+
+    pos = np.minimum(np.searchsorted(call_keys, link_keys), max(len(call_keys) - 1, 0))
+    on_molecule = call_keys[pos] == link_keys if len(call_keys) else np.zeros(len(link_keys), dtype=bool)
     if same_molecule:  # Filter out those not on same molecule (sometimes issue that a variant has no tier)
-        for tag in tags_haplotypes_all:
-            try:
-                haplotype = tags_haplotypes_all[tag]
-
-                haplotype = [var for var in haplotype if tag in list(variants_tags_tier[var])]
-
-                tags_haplotypes_all[tag] = haplotype
-            except KeyError:
-                haplotype = tags_haplotypes_all[tag]
-
-                haplotype = [var for var in haplotype if
-                             var in variants_tags_tier and tag in list(variants_tags_tier[var])]
+        with stage('same_molecule_filter') as record:
+            link_keys, pos = link_keys[on_molecule], pos[on_molecule]
+            entry_tiers = call_tiers[pos]
+            record.update(rows=len(on_molecule), removed=int((~on_molecule).sum()))
+    else:
+        entry_tiers = np.where(on_molecule, call_tiers[pos] if len(call_keys) else np.nan, np.nan)
+
+    tier_values, tier_codes = np.unique(entry_tiers, return_inverse=True)
+    return TagIndex(tags=np.asarray(tags, dtype=object), variants=np.asarray(variants, dtype=object),
+                    rows=(link_keys // n_variants).astype(np.int32), cols=(link_keys % n_variants).astype(np.int32),
+                    tier_codes=tier_codes.astype(np.min_scalar_type(len(tier_values))), tier_values=tier_values)
+
+
+def sheet_layout(index, mask):
+    # rows and columns of a sheet together with the worksheet cell of every masked entry
+    # (the first row holds the variants, the second the AF and the first column the tags)
+    sheet_rows, row_pos = np.unique(index.rows[mask], return_inverse=True)
+    sheet_cols, col_pos = np.unique(index.cols[mask], return_inverse=True)
+    return sheet_rows, sheet_cols, row_pos + 2, col_pos + 1
+
+
+def split_sheet(sheet, index, mask):
+    # Parts of a sheet which fit into a worksheet: the variants are split into blocks of the Excel columns and the
+    # tags of every block into blocks of the Excel rows. The first part keeps the name of the sheet, the others are
+    # numbered ('All_tiers (2)').
+    parts = []
+    sheet_cols, col_pos = np.unique(index.cols[mask], return_inverse=True)
+    entries = np.flatnonzero(mask)
+    col_blocks = col_pos // (EXCEL_MAX_COLUMNS - 1)
+    for col_block in range(col_blocks.max(initial=-1) + 1):
+        block_entries = entries[col_blocks == col_block]
+        row_blocks = np.unique(index.rows[block_entries], return_inverse=True)[1] // (EXCEL_MAX_ROWS - 2)
+        for row_block in range(row_blocks.max(initial=-1) + 1):
+            part = np.zeros(len(mask), dtype=bool)
+            part[block_entries[row_blocks == row_block]] = True
+            parts.append(part)
+    if len(parts) == 1:
+        return [(sheet, mask)]
+    return [(sheet if num == 1 else '{} ({})'.format(sheet, num), part) for num, part in enumerate(parts, 1)]
+
+
+def write_sheet_rows(ws, tags, cell_rows, cell_cols, values):
+    # the cells come sorted by row, so the tag rows are streamed in order (as constant_memory mode requires)
+    # and only the occupied cells of a row are written
+    current_row = None
+    for row_num, col_num, value in zip(cell_rows.tolist(), cell_cols.tolist(), values):
+        if row_num != current_row:
+            ws.write(row_num, 0, tags[row_num - 2])
+            current_row = row_num
+        ws.write_string(row_num, col_num, value)
+
+
+def analysis(analysis_sheet, analysis_writer, index, analysis_mask, analysis_freqs):
+    ws = analysis_writer.add_worksheet(analysis_sheet)
+    ws.set_column(0, 0, 30)
+    ws.set_column(1, EXCEL_MAX_COLUMNS - 1, 2.33)
+    ws.set_row(0, 95)
+    ws.freeze_panes(2, 1)
+
+    sheet_rows, sheet_cols, cell_rows, cell_cols = sheet_layout(index, analysis_mask)
+    worksheet_variants = index.variants[sheet_cols]
+    variants_freq = analysis_freqs[sheet_cols]
+    worksheet_columns = [i[:18] for i in worksheet_variants]
+
+    red = analysis_writer.add_format({'bg_color': '#FF4F33'})
+    green = analysis_writer.add_format({'bg_color': '#0FF235'})
+    blue = analysis_writer.add_format({'bg_color': '#33A8FF'})
+    orange = analysis_writer.add_format({'bg_color': '#FFB266'})
+    pink = analysis_writer.add_format({'bg_color': '#FF99FF'})
+    pink_dark = analysis_writer.add_format({'bg_color': '#FF00FF'})
+
+    l_col = len(worksheet_columns)
+    l_row = len(sheet_rows) + 1
+
+    rotate_up = analysis_writer.add_format()
+    rotate_up.set_rotation(90)
+
+    rotate_angel = analysis_writer.add_format()
+    rotate_angel.set_rotation(55)
+
+    ws.write_row(0, 1, worksheet_columns, rotate_angel)
+    ws.write(1, 0, 'AF')
+    ws.write_row(1, 1, [float(i) for i in variants_freq], rotate_up)
+    alleles = np.array([i[-1] for i in worksheet_variants], dtype=object)
+    write_sheet_rows(ws, index.tags[sheet_rows], cell_rows, cell_cols, alleles[cell_cols - 1])
+
+    ws.conditional_format(1, 1, l_row, l_col, {'type': 'text',
+                                               'criteria': 'begins with',
+                                               'value': 'A',
+                                               'format': green})
+    ws.conditional_format(1, 1, l_row, l_col, {'type': 'text',
+                                               'criteria': 'begins with',
+                                               'value': 'G',
+                                               'format': orange})
+    ws.conditional_format(1, 1, l_row, l_col, {'type': 'text',
+                                               'criteria': 'begins with',
+                                               'value': 'T',
+                                               'format': red})
+    ws.conditional_format(1, 1, l_row, l_col, {'type': 'text',
+                                               'criteria': 'begins with',
+                                               'value': 'C',
+                                               'format': blue})
+    ws.conditional_format(1, 1, 1, l_col, {'type': 'cell',
+                                           'criteria': 'between',
+                                           'minimum': 0.01,
+                                           'maximum': 0.4,
+                                           'format': pink})
+    ws.conditional_format(1, 1, 1, l_col, {'type': 'cell',
+                                           'criteria': 'between',
+                                           'minimum': 0.41,
+                                           'maximum': 1,
+                                           'format': pink_dark})
+
+
+def analysis_tier(tier_sheet, tier_writer, index, tier_mask, t_freqs):
+    ws = tier_writer.add_worksheet(tier_sheet)
+    ws.set_column(0, 0, 30)
+    ws.set_column(1, EXCEL_MAX_COLUMNS - 1, 3.33)
+    ws.set_row(0, 95)
+    ws.freeze_panes(2, 1)
+
+    sheet_rows, sheet_cols, cell_rows, cell_cols = sheet_layout(index, tier_mask)
+    tier_variants = index.variants[sheet_cols]
+    tier_variants_freq = t_freqs[sheet_cols].tolist()
+    tier_columns = [i[:18] for i in tier_variants]
+
+    t_rotate_up = tier_writer.add_format()
+    t_rotate_up.set_rotation(90)
+
+    t_rotate_angel = tier_writer.add_format()
+    t_rotate_angel.set_rotation(55)
+
+    ws.write_row(0, 1, tier_columns, t_rotate_angel)
+    ws.write(1, 0, 'AF')
+    ws.write_row(1, 1, tier_variants_freq, t_rotate_up)
+    tier_names = [str(tier) for tier in index.tier_values]
+    write_sheet_rows(ws, index.tags[sheet_rows], cell_rows, cell_cols,
+                     [tier_names[code] for code in index.tier_codes[tier_mask]])
+
+    l_col = len(tier_columns)
+    l_row = len(sheet_rows) + 1
+    t_red = tier_writer.add_format({'bg_color': '#FF4F33'})
+    t_green = tier_writer.add_format({'bg_color': '#0FF235'})
+    t_orange = tier_writer.add_format({'bg_color': '#FFB266'})
+    t_pink = tier_writer.add_format({'bg_color': '#FF99FF'})
+    t_pink_dark = tier_writer.add_format({'bg_color': '#FF00FF'})
+
+    ws.conditional_format(2, 1, l_row, l_col, {'type': 'text',
+                                               'criteria': 'begins with',
+                                               'value': '1',
+                                               'format': t_green})
+    ws.conditional_format(2, 1, l_row, l_col, {'type': 'text',
+                                               'criteria': 'begins with',
+                                               'value': '2',
+                                               'format': t_orange})
+    ws.conditional_format(2, 1, l_row, l_col, {'type': 'text',
+                                               'criteria': 'begins with',
+                                               'value': '3',
+                                               'format': t_red})
+    ws.conditional_format(2, 1, l_row, l_col, {'type': 'text',
+                                               'criteria': 'begins with',
+                                               'value': '4',
+                                               'format': t_red})
+    ws.conditional_format(2, 1, l_row, l_col, {'type': 'text',
+                                               'criteria': 'begins with',
+                                               'value': '5',
+                                               'format': t_red})
+    ws.conditional_format(2, 1, l_row, l_col, {'type': 'text',
+                                               'criteria': 'begins with',
+                                               'value': '6',
+                                               'format': t_red})
+    ws.conditional_format(2, 1, l_row, l_col, {'type': 'text',
+                                               'criteria': 'begins with',
+                                               'value': '7',
+                                               'format': t_red})
+
+    ws.conditional_format(1, 1, 1, l_col, {'type': 'cell',
+                                           'criteria': 'between',
+                                           'minimum': 0.01,
+                                           'maximum': 0.4,
+                                           'format': t_pink})
+    ws.conditional_format(1, 1, 1, l_col, {'type': 'cell',
+                                           'criteria': 'between',
+                                           'minimum': 0.41,
+                                           'maximum': 1,
+                                           'format': t_pink_dark})
+
+
+def update_frequencies(df_f, swit_snps, filtered_occ):
+    # V2 Updating frequency
+    # Obtain the original AF restricted to only those of high tier (forming haplotypes or lonely)
+    df_new = df_f.loc[~df_f.index.isin(swit_snps) & (df_f['AF (tiers 1.1-2.5)'] != 0),
+                      ['cvrg (tiers 1.1-2.5)', 'AC alt (tiers 1.1-2.5)', 'AF (tiers 1.1-2.5)']]
 
-                tags_haplotypes_all[tag] = haplotype
+    # the occurrences of the variants in the filtered list ( variants that must have their AF/AC updated from the
+    # original list)
+    filtered_occ = filtered_occ.reindex(df_new.index, fill_value=0)
+    remained_ac = df_new['AC alt (tiers 1.1-2.5)'] - filtered_occ
+
+    # variants left without any alt call are dropped, the others lose the filtered calls from their AC and cvrg
+    keep = (filtered_occ == 0) | (remained_ac != 0)
+    cvrg = df_new['cvrg (tiers 1.1-2.5)'] - filtered_occ
+    af = df_new['AF (tiers 1.1-2.5)'].where(filtered_occ == 0, remained_ac / cvrg)
+    return pd.DataFrame({'cvrg (tiers 1.1-2.5)': cvrg, 'AC alt (tiers 1.1-2.5)': remained_ac,
+                         'AF (tiers 1.1-2.5)': af})[keep]
+
+
+def write_haplotypes(outfile, sheet_writer, index, sheets):
+    # the workbook is streamed to disk row by row, so memory does not grow with the size of the sheets
+    workbook = xlsxwriter.Workbook(outfile, {'constant_memory': True})
+    for sheet, mask, freqs in sheets:
+        for part, part_mask in split_sheet(sheet, index, mask):
+            sheet_writer(part, workbook, index, part_mask, freqs)
+    workbook.close()
+
+
+def write_frequencies(outfile, df_new):
+    new_af_workbook = xlsxwriter.Workbook(outfile, {'constant_memory': True})
+    new_af_rows = zip(df_new.index, df_new['cvrg (tiers 1.1-2.5)'].tolist(), df_new['AC alt (tiers 1.1-2.5)'].tolist(),
+                      df_new['AF (tiers 1.1-2.5)'].tolist())
+    # more variants than rows of a worksheet continue on the next one
+    for part, _ in enumerate(range(0, max(len(df_new), 1), EXCEL_MAX_ROWS - 1), 1):
+        new_af_ws = new_af_workbook.add_worksheet("Allele frequencies" + (' ({})'.format(part) if part > 1 else ''))
+        new_af_ws.write_row(0, 0, ['variant ID', 'cvrg (tiers 1.1-2.5)', 'AC alt (tiers 1.1-2.5)',
+                                   'AF (tiers 1.1-2.5)'])
+        for n_row_num, n_row_data in enumerate(islice(new_af_rows, EXCEL_MAX_ROWS - 1)):
+            new_af_ws.write_row(n_row_num + 1, 0, n_row_data)
+    new_af_workbook.close()
 
-    swit_snps = [var for var in df_f.index.tolist() if
-                 df_f.loc[var]['AF (tiers 1.1-2.5)'] >= 0.6]  # SNPS of 60% or higher to be removed from the haplotypes
 
-    # All tiers sheet which will include all tags and their haplotypes regardless of their tiers
-    all_tiers = {tag: tags_haplotypes_all[tag] for tag in tags_haplotypes_all if len(tags_haplotypes_all[tag]) > 1}
-
-    min1_gd, min1_gd_f, final_hap, filtered_out, swit_haps = {}, {}, {}, {}, {}
-    for tag in all_tiers:
-        haplotype = all_tiers[tag]
-        if any(var in swit_snps for var in haplotype):
-            swit_haps[tag] = haplotype
-            haplotype = [var for var in haplotype if var not in swit_snps]
-            if len(haplotype) < 2:
+def haplotype_table(index, sheet, mask, freqs, value):
+    # long format of a sheet: one row per tag and variant with the allele or the tier of the variant on the tag
+    cols = index.cols[mask]
+    if value == 'allele':
+        values = pd.Series(index.variants[cols], dtype=object).str[-1].to_numpy()
+    else:
+        values = index.tier_values[index.tier_codes[mask]]
+    return pd.DataFrame({'sheet': sheet, 'tag': index.tags[index.rows[mask]], 'variant ID': index.variants[cols],
+                         'AF': freqs[cols], value: values})
+
+
+def write_haplotype_table(outfile, value, index, sheets, output_format):
+    # the sheets are appended one by one, so only one sheet is held as a table at a time
+    # (without any sheet an empty table is written, so that the file still has the columns)
+    sheets = sheets or [('', np.zeros(len(index.rows), dtype=bool), np.zeros(len(index.variants)))]
+    if output_format == 'parquet':
+        import pyarrow as pa  # only needed for Parquet output, like for Parquet input
+        import pyarrow.parquet as pq
+
+        writer = None
+        for sheet, mask, freqs in sheets:
+            table = pa.Table.from_pandas(haplotype_table(index, sheet, mask, freqs, value), preserve_index=False)
+            writer = writer or pq.ParquetWriter(outfile, table.schema)
+            writer.write_table(table)
+        writer.close()
+    else:
+        for num, (sheet, mask, freqs) in enumerate(sheets):
+            haplotype_table(index, sheet, mask, freqs, value).to_csv(outfile, sep='\t', index=False,
+                                                                     header=num == 0, mode='w' if num == 0 else 'a')
+
+
+def write_frequency_table(outfile, df_new, output_format):
+    df_new = df_new.rename_axis('variant ID').reset_index()
+    if output_format == 'parquet':
+        df_new.to_parquet(outfile, index=False)
+    else:
+        df_new.to_csv(outfile, sep='\t', index=False)
+
+
+# the sheets of the haplotype summary, the distinct haplotypes of all tags and of the final haplotypes
+SUMMARY_SHEETS = ['All_tiers', 'lowfreq 0r1']
+
+
+def aggregate_haplotypes(index, mask):
+    # Identical haplotypes of the masked entries: every tag is hashed by its canonical variant set, the sorted codes
+    # of its variants (the entries are already sorted by variant within a tag). One row per distinct haplotype with
+    # its number of tags and the number of its variant calls of every tier, most frequent first.
+    rows, cols, tier_codes = index.rows[mask], index.cols[mask], index.tier_codes[mask]
+    starts = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1]]) if len(rows) else np.zeros(0, dtype=int)
+    bounds = np.r_[starts, len(rows)]
+    hap_codes, uniques = pd.factorize(np.fromiter((cols[start:end].tobytes() for start, end in
+                                                   zip(bounds[:-1], bounds[1:])), dtype=object, count=len(starts)))
+    n_haps = len(uniques)
+
+    entry_haps = np.repeat(hap_codes, np.diff(bounds))
+    n_tiers = len(index.tier_values)
+    tiers = np.bincount(entry_haps * n_tiers + tier_codes, minlength=n_haps * n_tiers).reshape(n_haps, n_tiers)
+
+    first_tags = np.unique(hap_codes, return_index=True)[1]
+    representative, lengths = starts[first_tags], np.diff(bounds)[first_tags]
+    haplotypes = pd.DataFrame({'haplotype': [', '.join(index.variants[cols[start:start + length]])
+                                             for start, length in zip(representative, lengths)],
+                               'variants': lengths,
+                               'tags': np.bincount(hap_codes, minlength=n_haps)})
+    for tier, counts in zip(index.tier_values, tiers.T):
+        haplotypes['tier {}'.format(tier)] = counts
+    return haplotypes.sort_values('tags', ascending=False, kind='stable').reset_index(drop=True)
+
+
+def variant_cooccurrence(index, mask):
+    # number of tags carrying both variants of every pair, from the product of the sparse tag x variant matrix with
+    # its transpose (the diagonal holds the number of tags of every variant)
+    from scipy import sparse  # only needed for the haplotype summary
+
+    rows, cols = index.rows[mask], index.cols[mask]
+    matrix = sparse.csr_matrix((np.ones(len(rows), dtype=np.int64), (rows, cols)),
+                               shape=(len(index.tags), len(index.variants)))
+    product = (matrix.T @ matrix).tocoo()
+    tags = product.diagonal()
+    pair = product.row < product.col
+    var_1, var_2, both = product.row[pair], product.col[pair], product.data[pair]
+    pairs = pd.DataFrame({'variant 1': index.variants[var_1], 'variant 2': index.variants[var_2], 'tags': both,
+                          'tags variant 1': tags[var_1], 'tags variant 2': tags[var_2]})
+    return pairs.sort_values(['tags', 'variant 1', 'variant 2'], ascending=[False, True, True],
+                             kind='stable').reset_index(drop=True)
+
+
+def haplotype_summary(index, masks):
+    # distinct haplotypes and variant pairs of the SUMMARY_SHEETS, each with a sheet column
+    haplotypes, pairs = [], []
+    for sheet, mask in zip(SHEET_NAMES, masks):
+        if sheet in SUMMARY_SHEETS:
+            haplotypes.append(aggregate_haplotypes(index, mask).assign(sheet=sheet))
+            pairs.append(variant_cooccurrence(index, mask).assign(sheet=sheet))
+    haplotypes, pairs = pd.concat(haplotypes), pd.concat(pairs)
+    # every tier column of the index is in all frames, the sheet column goes first
+    return (haplotypes[['sheet'] + list(haplotypes.columns[:-1])].fillna(0),
+            pairs[['sheet'] + list(pairs.columns[:-1])])
+
+
+def write_haplotype_summary(outfile, haplotypes, pairs):
+    workbook = xlsxwriter.Workbook(outfile, {'constant_memory': True})
+    for name, df in [('Haplotypes', haplotypes), ('Variant pairs', pairs)]:
+        rows = df.itertuples(index=False, name=None)
+        # more rows than a worksheet holds continue on the next one, like the allele frequencies
+        for part, _ in enumerate(range(0, max(len(df), 1), EXCEL_MAX_ROWS - 1), 1):
+            ws = workbook.add_worksheet(name + (' ({})'.format(part) if part > 1 else ''))
+            ws.write_row(0, 0, list(df.columns))
+            for row_num, row_data in enumerate(islice(rows, EXCEL_MAX_ROWS - 1)):
+                ws.write_row(row_num + 1, 0, row_data)
+            ws.set_column(1, 1, 50 if name == 'Haplotypes' else 25)
+            ws.set_column(2, 2, 8 if name == 'Haplotypes' else 25)
+            ws.freeze_panes(1, 0)
+    workbook.close()
+
+
+# number of variants of a region read by one worker from the DCS BAM
+BAM_REGION_VARIANTS = 200
+
+
+def dcs_tier(mates):
+    # The variant analyser tiers also need the SSCS reads, in a DCS BAM only the two mates of a tag can be compared:
+    # both mates carry the alt allele (1.1), only one mate covers the variant with a base other than N (2.1) or the
+    # mates disagree (4).
+    if len(mates) == 1:
+        return 2.1
+    return 1.1 if len(set(mates.values())) == 1 else 4.0
+
+
+def bam_region_calls(bam_file, variants):
+    # Alt calls of the variants (sorted variant IDs of one chromosome) in the reads of a DCS BAM. Every variant is
+    # read with an indexed pileup of its position only, so only the reads overlapping it are held in memory.
+    # Only the primary records of the mates count: unmapped, secondary, QC failed and duplicate records are skipped
+    # by the pileup, supplementary ones and records without a sequence here.
+    import pysam  # only needed for the DCS BAM input
+
+    calls = []
+    with pysam.AlignmentFile(bam_file, 'rb') as bam:
+        for variant in variants:
+            chrom, pos, ref, alt = variant.rsplit('-', 3)
+            if chrom not in bam.references:
                 continue
-        tiers = [variants_tags_tier[var][tag] for var in haplotype]
-
-        if any(i < 3 for i in tiers):  # if any variant is from good tier then pass the haplotype to min1_gd
-            min1_gd[tag] = haplotype
-            filter_hap = [var for var in haplotype if
-                          tiers[haplotype.index(var)] < 3]  # filter out variants of bad tiers  of the same haplotype
-
-            if len(filter_hap) > 1:  # if the remaining haplotype is more than 1 variant after removing the bad tiers
-                # then pass it to min1_gd_f
-                min1_gd_f[tag] = filter_hap
-                # final_hap
-                counter = 0
-                freqs = [variants_freq_gd[var] for var in filter_hap]
-                for num in freqs:
-                    if num < 0.01:
-                        counter = counter + 1
-                if counter < 2:
-                    final_hap[tag] = filter_hap
-
-    filtered_out = {tag: min1_gd_f[tag] for tag in min1_gd_f if tag not in final_hap}
-
-    # V2 Updating frequency
-    df_new = df_f[['cvrg (tiers 1.1-2.5)', 'AC alt (tiers 1.1-2.5)', 'AF (tiers 1.1-2.5)']]  # Obtain the original AF
-    for var in df_new.index.tolist():  # Restrict the list to only those of high tier (forming haplotypes or lonely)
-        if var in swit_snps or df_new.loc[var]['AF (tiers 1.1-2.5)'] == 0:
-            df_new = df_new.drop(var)
+            tags = {}
+            for column in bam.pileup(chrom, int(pos) - 1, int(pos), truncate=True, stepper='all',
+                                     min_base_quality=0, ignore_overlaps=False, ignore_orphans=False,
+                                     max_depth=10 ** 8):
+                for read in column.pileups:
+                    if read.is_del or read.is_refskip or read.alignment.is_supplementary or \
+                            read.alignment.query_sequence is None:
+                        continue
+                    base = read.alignment.query_sequence[read.query_position]
+                    if base != 'N':  # no consensus of the strands
+                        tags.setdefault(read.alignment.query_name, {})[read.alignment.is_read2] = base
+            calls.extend((tag, variant, dcs_tier(mates)) for tag, mates in tags.items() if alt in mates.values())
+    return calls
+
+
+def variant_positions(variants):
+    # chromosome and position of the variant IDs (chr17-39688162-C-T), IDs of another form get a chromosome of
+    # their own at position 0
+    ids = pd.Series(variants, dtype=object)
+    fields = ids.str.rsplit('-', n=3)
+    position = pd.to_numeric(fields.str[1], errors='coerce')
+    parsed = (fields.str.len() == 4) & position.notna()
+    chrom = fields.str[0].where(parsed, ids)
+    return chrom.to_numpy(dtype=object), position.where(parsed, 0).to_numpy(dtype=np.int64)
+
+
+def read_dcs_bam(bam_file, variants, processes=1):
+    # Summary of the calls of a DCS BAM in the layout of the variant analyser summary (one row per tag and
+    # variant). The SNVs are read in regions of BAM_REGION_VARIANTS variants of a chromosome, by processes workers.
+    fields = pd.Series(np.asarray(variants, dtype=object)).str.rsplit('-', n=3)
+    snv = (fields.str.len() == 4) & (fields.str[2].str.len() == 1) & (fields.str[3].str.len() == 1)
+    snvs = np.asarray(variants, dtype=object)[snv.to_numpy(dtype=bool)]
+    chrom, position = variant_positions(snvs)
+    order = np.lexsort((position, pd.factorize(chrom, sort=True)[0]))
+    snvs, chrom = snvs[order], chrom[order]
+    chromosomes = np.split(snvs, np.flatnonzero(chrom[1:] != chrom[:-1]) + 1)
+    regions = [group[start:start + BAM_REGION_VARIANTS].tolist() for group in chromosomes
+               for start in range(0, len(group), BAM_REGION_VARIANTS)]
+
+    with ProcessPoolExecutor(max_workers=processes) if processes > 1 else nullcontext() as executor:
+        jobs = (repeat(bam_file), regions)
+        calls = list(chain.from_iterable(executor.map(bam_region_calls, *jobs) if executor else
+                                         map(bam_region_calls, *jobs)))
+    df_s = pd.DataFrame(calls, columns=['tag', 'variant ID', 'tier'])
+    df_s['in phase'] = ','  # all variants of a tag are on the same molecule, the tag links them
+    return df_s[SUMMARY_COLUMNS]
+
+
+def read_summary(summary, cache_dir=None):
+    # summary file or a DataFrame of the variant analyser summary
+    if isinstance(summary, pd.DataFrame):
+        df_s = summary[SUMMARY_COLUMNS].copy()
+    else:
+        df_s = read_table(summary, SUMMARY_COLUMNS, cache_dir)
+    df_s['variant ID'] = df_s['variant ID'].fillna(',')
+    df_s['in phase'] = df_s['in phase'].fillna(',')
+    return df_s
 
-    original_ac = {i: int(df_new.loc[i]['AC alt (tiers 1.1-2.5)']) for i in df_new.index.tolist() if
-                   df_new.loc[i]['AC alt (tiers 1.1-2.5)'] != 0}  # put the variants in a dictionary with their AC
-    # the occurrences of the variants in the filtered list ( variants that must have their AF/AC updated from the
-    # original list)
-    filtered_occ = sum(filtered_out.values(), [])
-    filtered_occ = dict(Counter(filtered_occ))
-    remained_ac = {}  # Results list (full variants)
-    for i in original_ac:
-        if i in filtered_occ:
 
-            remained_ac[i] = original_ac[i] - filtered_occ[i]
-        else:
-            remained_ac[i] = original_ac[i]
-
-    for variant in df_new.index.tolist():  # re updating the frequency dataframe and take only a sub part of relevant
-        # columns in order to past it to a new Excel sheet
-        if df_new.loc[variant]['AC alt (tiers 1.1-2.5)'] != remained_ac[variant] and remained_ac[variant] == 0:
-            df_new = df_new.drop(variant)
-        elif df_new.loc[variant]['AC alt (tiers 1.1-2.5)'] != remained_ac[variant] and remained_ac[variant] != 0:
-            diff = (df_new.loc[variant]['AC alt (tiers 1.1-2.5)'] - remained_ac[variant])
-            cvg = df_new.loc[variant]['cvrg (tiers 1.1-2.5)']
-            df_new.at[variant, 'cvrg (tiers 1.1-2.5)'] = cvg - diff
-            df_new.at[variant, 'AC alt (tiers 1.1-2.5)'] = remained_ac[variant]
-            df_new.at[variant, 'AF (tiers 1.1-2.5)'] =\
-                df_new.loc[variant]['AC alt (tiers 1.1-2.5)'] / df_new.loc[variant]['cvrg (tiers 1.1-2.5)']
-    
-    new_af_workbook = xlsxwriter.Workbook(outfile3)
-    new_af_ws = new_af_workbook.add_worksheet("Allele frequencies")
-    df_new_out =  df_new.reset_index()
-    new_af_ws.write(0,0,'variant ID')
-    new_af_ws.write(0,1,'cvrg (tiers 1.1-2.5)')
-    new_af_ws.write(0,2,'AC alt (tiers 1.1-2.5)')
-    new_af_ws.write(0,3,'AF (tiers 1.1-2.5)')
-    for n_row_num, n_row_data in df_new_out.iterrows():
-        for n_col_num, n_col_data in enumerate(row_data):
-            new_af_ws.write(n_row_num+1, n_col_num, n_col_data)
-    new_af_workbook.close()
+def read_frequencies(frequency, cache_dir=None):
+    # frequency file or a DataFrame of the variant analyser frequencies, indexed by the variant ID
+    if isinstance(frequency, pd.DataFrame):
+        df_f = frequency if frequency.index.name == 'variant ID' else frequency.set_index('variant ID')
+        return df_f[FREQUENCY_COLUMNS[1:]]
+    return read_table(frequency, FREQUENCY_COLUMNS, cache_dir).set_index('variant ID')
 
-    variants_freq_updated = {var: df_new.loc[var]['AF (tiers 1.1-2.5)'] for var in df_new.index.tolist()}
-    tags_variants_tier = {tag: {var: variants_tags_tier[var][tag] for var in all_tiers[tag]} for tag in all_tiers}
 
-    def analysis(analysis_sheet, analysis_writer, analysis_dic, analysis_freq_dic):
-        try:
-            ws = analysis_writer.add_worksheet(analysis_sheet)
-            container = []
-
-            worksheet_variants = [item for sublist in list(analysis_dic.values()) for item in sublist]
-            worksheet_variants = sorted(list(set(worksheet_variants)))
-            variants_freq = [analysis_freq_dic[i] for i in worksheet_variants]
-
-            worksheet_columns = [i[:18] for i in worksheet_variants]
-
-            for tag_analysis in list(analysis_dic):
-                lst_temp = []
-
-                for variant_a in worksheet_variants:
-                    if variant_a in analysis_dic[tag_analysis]:
-                        lst_temp.append(variant_a[-1])
-                    else:
-                        lst_temp.append('')
-                container.append(lst_temp)
-
-            df_result = pd.DataFrame(columns=worksheet_columns)
-            df_result.loc['AF'] = ''
-
-            for tag_analysis in list(analysis_dic):
-                df_result.loc[tag_analysis] = container[(list(analysis_dic).index(tag_analysis))]
-            
-            df_result_temp = df_result.reset_index()
-            for row_num, row_data in df_result_temp.iterrows():
-                for col_num, col_data in enumerate(row_data):
-                    ws.write(row_num + 1, col_num, col_data)
-
-
-            red = analysis_writer.add_format({'bg_color': '#FF4F33'})
-            green = analysis_writer.add_format({'bg_color': '#0FF235'})
-            blue = analysis_writer.add_format({'bg_color': '#33A8FF'})
-            orange = analysis_writer.add_format({'bg_color': '#FFB266'})
-            pink = analysis_writer.add_format({'bg_color': '#FF99FF'})
-            pink_dark = analysis_writer.add_format({'bg_color': '#FF00FF'})
-
-            l_col = len(list(df_result))
-            l_row = len(df_result.index.tolist())
-
-            rotate_up = analysis_writer.add_format()
-            rotate_up.set_rotation(90)
-
-            rotate_angel = analysis_writer.add_format()
-            rotate_angel.set_rotation(55)
-
-            for one in range(len(variants_freq)):
-                ws.write(0, one + 1, list(df_result)[one], rotate_angel)
-                ws.write(1, one + 1, float(variants_freq[one]), rotate_up)
-
-            ws.conditional_format(1, 1, l_row, l_col, {'type': 'text',
-                                                                    'criteria': 'begins with',
-                                                                    'value': 'A',
-                                                                    'format': green})
-            ws.conditional_format(1, 1, l_row, l_col, {'type': 'text',
-                                                                    'criteria': 'begins with',
-                                                                    'value': 'G',
-                                                                    'format': orange})
-            ws.conditional_format(1, 1, l_row, l_col, {'type': 'text',
-                                                                    'criteria': 'begins with',
-                                                                    'value': 'T',
-                                                                    'format': red})
-            ws.conditional_format(1, 1, l_row, l_col, {'type': 'text',
-                                                                    'criteria': 'begins with',
-                                                                    'value': 'C',
-                                                                    'format': blue})
-            ws.conditional_format(1, 1, 1, l_col, {'type': 'cell',
-                                                                'criteria': 'between',
-                                                                'minimum': 0.01,
-                                                                'maximum': 0.4,
-                                                                'format': pink})
-            ws.conditional_format(1, 1, 1, l_col, {'type': 'cell',
-                                                                'criteria': 'between',
-                                                                'minimum': 0.41,
-                                                                'maximum': 1,
-                                                                'format': pink_dark})
-
-            ws.set_column(0, 0, 30)
-            ws.set_column(1, 9999, 2.33)
-            ws.set_row(0, 95)
-            ws.freeze_panes(2, 1)
-        except ValueError:
-            pass
-
-    def analysis_tier(tier_sheet, tier_writer, tier_dic, variant_tier, t_dic_a):
-        try:
-            ws = tier_writer.add_worksheet(tier_sheet)
-            tier_container = []
-            tier_variants = [item for sublist in list(tier_dic.values()) for item in sublist]
-            tier_variants = sorted(list(set(tier_variants)))
-            tier_variants_freq = [t_dic_a[i] for i in tier_variants]
-            tier_columns = [i[:18] for i in tier_variants]
-           
-            for tag_tier in list(tier_dic):
-                tier_lst_temp = []
-
-                for tier_variant in tier_variants:
-                    if tier_variant in tier_dic[tag_tier]:
-                        tier_lst_temp.append(str(variant_tier[tag_tier][tier_variant]))
-                    else:
-                        tier_lst_temp.append('')
-                tier_container.append(tier_lst_temp)
-
-            df_tier_result = pd.DataFrame(columns=tier_columns)
-            df_tier_result.loc['AF'] = tier_variants_freq
-
-            for tag_tier in list(tier_dic):
-                df_tier_result.loc[tag_tier] = tier_container[(list(tier_dic).index(tag_tier))]
-
-
-            df_tier_result_temp = df_tier_result.reset_index()
-
-            for row_num, row_data in df_tier_result_temp.iterrows():
-                for col_num, col_data in enumerate(row_data):
-                    ws.write(row_num + 1, col_num, col_data)
-            
-
-
-
-            t_rotate_up = tier_writer.add_format()
-            t_rotate_up.set_rotation(90)
-
-            t_rotate_angel = tier_writer.add_format()
-            t_rotate_angel.set_rotation(55)
-
-            for one in range(len(tier_variants_freq)):
-                ws.write(0, one + 1, list(df_tier_result)[one], t_rotate_angel)
-                ws.write(1, one + 1, tier_variants_freq[one], t_rotate_up)
-
-            l_col = len(list(df_tier_result))
-            l_row = len(df_tier_result.index.tolist())
-            t_red = tier_writer.add_format({'bg_color': '#FF4F33'})
-            t_green = tier_writer.add_format({'bg_color': '#0FF235'})
-            t_orange = tier_writer.add_format({'bg_color': '#FFB266'})
-            t_pink = tier_writer.add_format({'bg_color': '#FF99FF'})
-            t_pink_dark = tier_writer.add_format({'bg_color': '#FF00FF'})
-
-            ws.conditional_format(2, 1, l_row, l_col, {'type': 'text',
-                                                               'criteria': 'begins with',
-                                                               'value': '1',
-                                                               'format': t_green})
-            ws.conditional_format(2, 1, l_row, l_col, {'type': 'text',
-                                                               'criteria': 'begins with',
-                                                               'value': '2',
-                                                               'format': t_orange})
-            ws.conditional_format(2, 1, l_row, l_col, {'type': 'text',
-                                                               'criteria': 'begins with',
-                                                               'value': '3',
-                                                               'format': t_red})
-            ws.conditional_format(2, 1, l_row, l_col, {'type': 'text',
-                                                               'criteria': 'begins with',
-                                                               'value': '4',
-                                                               'format': t_red})
-            ws.conditional_format(2, 1, l_row, l_col, {'type': 'text',
-                                                               'criteria': 'begins with',
-                                                               'value': '5',
-                                                               'format': t_red})
-            ws.conditional_format(2, 1, l_row, l_col, {'type': 'text',
-                                                               'criteria': 'begins with',
-                                                               'value': '6',
-                                                               'format': t_red})
-            ws.conditional_format(2, 1, l_row, l_col, {'type': 'text',
-                                                               'criteria': 'begins with',
-                                                               'value': '7',
-                                                               'format': t_red})
-
-            ws.conditional_format(1, 1, 1, l_col, {'type': 'cell',
-                                                           'criteria': 'between',
-                                                           'minimum': 0.01,
-                                                           'maximum': 0.4,
-                                                           'format': t_pink})
-            ws.conditional_format(1, 1, 1, l_col, {'type': 'cell',
-                                                           'criteria': 'between',
-                                                           'minimum': 0.41,
-                                                           'maximum': 1,
-                                                           'format': t_pink_dark})
-
-            ws.set_column(0, 0, 30)
-            ws.set_column(1, 9999, 3.33)
-            ws.set_row(0, 95)
-            ws.freeze_panes(2, 1)
-        except ValueError:
-            pass
-
-    sheet_names = ['All_tiers', 'Hap_1+', 'HapHQ', 'lowfreq 0r1', 'lowfreq >1', 'swit_haps']
-    dic_lst = [all_tiers, min1_gd, min1_gd_f, final_hap, filtered_out, swit_haps]
-
-    writer = xlsxwriter.Workbook(outfile1)
-    writer_tier = xlsxwriter.Workbook(outfile2)
-
-
-    for dictionary in dic_lst:  # to remove when a dictionary is empty
-
-        if len(dictionary) < 1:
-            sheet_names.pop(dic_lst.index(dictionary))
-            dic_lst.pop(dic_lst.index(dictionary))
-
-    for sheet, dic in zip(sheet_names, dic_lst):
+def swit_filter(index, swit_snps):
+    # The first step of the classification, which only depends on the SNPS (flagged per variant code in swit_snps).
+    # Every haplotype category is a mask over the entries of the index, the counts per tag are taken with bincount.
+    # All tiers sheet which will include all tags and their haplotypes regardless of their tiers
+    all_tiers = tag_counts(index, np.ones(len(index.rows), dtype=bool)) > 1
+
+    swit = swit_snps[index.cols]
+    swit_haps = all_tiers & (tag_counts(index, all_tiers & swit) > 0)
+    haplotype = all_tiers & ~swit
+    haplotype &= tag_counts(index, haplotype) > 1  # the haplotype must keep 2 variants after removing the SNPS
+    return all_tiers, swit_haps, haplotype
+
+
+def classify_haplotypes(index, variants_freq_gd, thresholds=DEFAULT_THRESHOLDS, swit_masks=None):
+    # variants_freq_gd holds the AF of every variant code, swit_masks may hold the result of swit_filter for the
+    # switAF of the thresholds
+    if swit_masks is None:
+        swit_masks = swit_filter(index, variants_freq_gd >= thresholds.switAF)
+    all_tiers, swit_haps, haplotype = swit_masks
+
+    good = (index.tier_values < thresholds.goodTier)[index.tier_codes]
+    # if any variant is from good tier then pass the haplotype to min1_gd
+    min1_gd = haplotype & (tag_counts(index, haplotype & good) > 0)
+    # filter out variants of bad tiers of the same haplotype, more than 1 variant must remain for min1_gd_f
+    min1_gd_f = min1_gd & good
+    min1_gd_f &= tag_counts(index, min1_gd_f) > 1
+    # final_hap: less than maxLowFreq of the variants are of low frequency
+    low_freq = variants_freq_gd[index.cols] < thresholds.lowFreqAF
+    final_hap = min1_gd_f & (tag_counts(index, min1_gd_f & low_freq) < thresholds.maxLowFreq)
+    filtered_out = min1_gd_f & ~final_hap
+
+    return all_tiers, min1_gd, min1_gd_f, final_hap, filtered_out, swit_haps
+
+
+def tag_counts(index, entries):
+    # number of selected entries on the tag of every entry
+    return np.bincount(index.rows[entries], minlength=len(index.tags))[index.rows]
+
+
+def count_tags(index, mask):
+    rows = index.rows[mask]  # sorted, so every new tag starts a run
+    return int(np.count_nonzero(np.diff(rows))) + (len(rows) > 0)
+
+
+def filtered_occurrences(index, filtered_out):
+    # the AC and cvrg of the frequency file only count the calls of tiers 1.1-2.5, so only those are taken off
+    # again (a goodTier above 3 also filters out calls of worse tiers)
+    counted = ((index.tier_values >= 1.1) & (index.tier_values <= 2.5))[index.tier_codes]
+    return pd.Series(np.bincount(index.cols[filtered_out & counted], minlength=len(index.variants)),
+                     index=index.variants)
+
+
+def shard_rows(df_s, tag_codes, window=0):
+    # Splits the rows of the summary into shards by chromosome, or by windows of that many bases of a chromosome.
+    # A tag is never split: all its rows go to the shard of its first variant (by chromosome and position), so that
+    # a tag whose variants span a shard boundary is still indexed and classified as a whole. Tags without any call
+    # form a shard of their own, rows without a tag are dropped as in build_tag_index.
+    is_call = (df_s['variant ID'] != ',').to_numpy() & (tag_codes >= 0)
+    var_codes, variants = pd.factorize(df_s['variant ID'].to_numpy()[is_call])
+    chrom, position = variant_positions(variants)
+    chrom_codes = pd.factorize(chrom, sort=True)[0].astype(np.int64)
+    windows = position // window if window else np.zeros(len(position), dtype=np.int64)
+    variant_shards = chrom_codes * (windows.max(initial=0) + 1) + windows
+
+    rank = np.empty(len(variants), dtype=np.int64)
+    rank[np.lexsort((position, chrom_codes))] = np.arange(len(variants))
+    tag_first = np.full(tag_codes.max(initial=-1) + 1, len(variants), dtype=np.int64)
+    np.minimum.at(tag_first, tag_codes[is_call], rank[var_codes])
+    tag_shards = np.r_[variant_shards[np.argsort(rank)], -1][tag_first]
+
+    has_tag = np.flatnonzero(tag_codes >= 0)
+    row_shards = np.unique(tag_shards[tag_codes[has_tag]], return_inverse=True)[1]
+    rows = has_tag[np.argsort(row_shards, kind='stable')]  # the rows of a shard keep the order of the summary
+    return np.split(rows, np.cumsum(np.bincount(row_shards))[:-1]) if len(rows) else []
+
+
+def classify_shard(df_s, variants_freq_gd, thresholds, same_molecule=True):
+    # index and classification of the rows of one shard, the tags are the tag codes of the whole summary
+    index = build_tag_index(df_s, same_molecule)
+    masks = classify_haplotypes(index, variants_freq_gd.reindex(index.variants).to_numpy(), thresholds)
+    return index, masks, filtered_occurrences(index, masks[4]).to_numpy()
+
+
+def classify_sharded(df_s, variants_freq_gd, thresholds=DEFAULT_THRESHOLDS, window=0, processes=1,
+                     same_molecule=True):
+    # The tag index is built and classified shard by shard, by processes workers. The shard indexes are merged into
+    # the index of the whole summary (the same as build_tag_index returns), their masks and filtered occurrences
+    # into those of the merged index.
+    tag_codes, tags = pd.factorize(df_s['tag'])
+    shards = shard_rows(df_s, tag_codes, window)
+    df_s = df_s.assign(tag=tag_codes)  # the workers get the tag codes, not the tag strings
+
+    jobs = ((df_s.iloc[rows] for rows in shards), repeat(variants_freq_gd), repeat(thresholds), repeat(same_molecule))
+    with ProcessPoolExecutor(max_workers=processes) if processes > 1 else nullcontext() as executor:
+        results = list(executor.map(classify_shard, *jobs) if executor else map(classify_shard, *jobs))
+    if not results:  # a summary without any tag
+        results = [classify_shard(df_s.iloc[:0], variants_freq_gd, thresholds, same_molecule)]
+
+    variants = np.unique(np.concatenate([index.variants for index, _, _ in results]))
+    tier_values = np.unique(np.concatenate([index.tier_values for index, _, _ in results]))
+    rows, cols, tier_codes = [], [], []
+    masks = [[] for _ in SHEET_NAMES]
+    filtered_occ = np.zeros(len(variants), dtype=np.int64)
+    for index, shard_masks, shard_occ in results:
+        shard_cols = np.searchsorted(variants, index.variants)
+        rows.append(index.tags[index.rows].astype(np.int32))
+        cols.append(shard_cols[index.cols].astype(np.int32))
+        tier_codes.append(np.searchsorted(tier_values, index.tier_values)[index.tier_codes])
+        for mask, shard_mask in zip(masks, shard_masks):
+            mask.append(shard_mask)
+        np.add.at(filtered_occ, shard_cols, shard_occ)
+
+    # every shard is sorted by tag code and variant, and a tag is in one shard only
+    rows = np.concatenate(rows)
+    order = np.argsort(rows, kind='stable')
+    index = TagIndex(tags=np.asarray(tags, dtype=object), variants=variants, rows=rows[order],
+                     cols=np.concatenate(cols)[order],
+                     tier_codes=np.concatenate(tier_codes)[order].astype(np.min_scalar_type(len(tier_values))),
+                     tier_values=tier_values)
+    masks = tuple(np.concatenate(mask)[order] for mask in masks)
+    return index, masks, pd.Series(filtered_occ, index=variants), len(shards)
+
+
+def haplotype_sheets(masks, variants_freq_all, variants_freq_gd, variants_freq_updated):
+    sheets = []
+    for sheet, mask in zip(SHEET_NAMES, masks):
+        if not mask.any():  # to remove when a sheet has no haplotypes
+            continue
 
         if sheet == 'lowfreq 0r1':
             f_dic_a = variants_freq_updated
@@ -399,11 +828,231 @@ def haplotype_analyser(argv):
         else:
             f_dic_a = variants_freq_all
 
-        analysis(sheet, writer, dic, f_dic_a)
-        analysis_tier(sheet, writer_tier, dic, tags_variants_tier, f_dic_a)
-
-    writer.close()
-    writer_tier.close()
+        sheets.append((sheet, mask, f_dic_a))
+    return sheets
+
+
+def output_files(prefix, output_format='xlsx'):
+    return [prefix + suffix + '.' + output_format for suffix in OUTPUT_SUFFIXES]
+
+
+def write_outputs(outfile1, outfile2, outfile3, df_new, index, sheets, concurrent=False, output_format='xlsx'):
+    if output_format == 'xlsx':
+        output_jobs = [(write_frequencies, outfile3, df_new),
+                       (write_haplotypes, outfile1, analysis, index, sheets),
+                       (write_haplotypes, outfile2, analysis_tier, index, sheets)]
+    else:
+        output_jobs = [(write_frequency_table, outfile3, df_new, output_format),
+                       (write_haplotype_table, outfile1, 'allele', index, sheets, output_format),
+                       (write_haplotype_table, outfile2, 'tier', index, sheets, output_format)]
+    if concurrent:  # every workbook is written by its own process
+        with ProcessPoolExecutor(max_workers=len(output_jobs)) as executor:
+            for future in [executor.submit(*job) for job in output_jobs]:
+                future.result()
+    else:
+        for job in output_jobs:
+            job[0](*job[1:])
+
+
+def read_sweep(path, defaults):
+    grid = pd.read_csv(path, sep='\t', dtype=str, keep_default_na=False)
+    unknown = set(grid.columns) - set(Thresholds._fields) - {'output'}
+    if unknown:
+        raise ValueError('{}: unknown sweep columns {}'.format(path, ', '.join(sorted(unknown))))
+
+    settings = []
+    for row in grid.to_dict('records'):
+        thresholds = defaults._replace(**{name: type(getattr(defaults, name))(row[name]) for name in Thresholds._fields
+                                          if row.get(name, '') != ''})
+        settings.append((thresholds, row.get('output', '')))
+    return settings
+
+
+def sweep(index, df_f, settings, summary_file, concurrent=False, output_format='xlsx', stage=no_profile):
+    # every setting is evaluated against the same index, the frequencies and the SNPS of a switAF are only
+    # computed once
+    variants = pd.Index(index.variants)
+    variants_freq_all = df_f['AF (all tiers)'].reindex(variants).to_numpy()
+    variants_freq_gd = df_f['AF (tiers 1.1-2.5)'].reindex(variants).to_numpy()
+    swit_cache = {}
+
+    summary = []
+    for thresholds, prefix in settings:
+        with stage('setting') as record:
+            if thresholds.switAF not in swit_cache:
+                swit_cache[thresholds.switAF] = swit_filter(index, variants_freq_gd >= thresholds.switAF)
+            masks = classify_haplotypes(index, variants_freq_gd, thresholds, swit_cache[thresholds.switAF])
+
+            filtered_occ = filtered_occurrences(index, masks[4])
+            df_new = update_frequencies(df_f, df_f.index[df_f['AF (tiers 1.1-2.5)'] >= thresholds.switAF],
+                                        filtered_occ)
+            updated = filtered_occ.reindex(df_new.index, fill_value=0) > 0
+
+            summary.append(dict(thresholds._asdict(), **{sheet: count_tags(index, mask)
+                                                         for sheet, mask in zip(SHEET_NAMES, masks)},
+                                **{'updated AF': int(updated.sum()), 'variants': len(df_new), 'output': prefix}))
+            if prefix:
+                variants_freq_updated = df_new['AF (tiers 1.1-2.5)'].reindex(variants).to_numpy()
+                sheets = haplotype_sheets(masks, variants_freq_all, variants_freq_gd, variants_freq_updated)
+                write_outputs(*output_files(prefix, output_format), df_new, index, sheets, concurrent,
+                              output_format)
+            record.update(thresholds._asdict(), tags=summary[-1]['All_tiers'])
+
+    pd.DataFrame(summary).to_csv(summary_file, sep='\t', index=False)
+
+
+# Result of the analysis of a library: the tag index, the masks of the SHEET_NAMES over its entries, the updated
+# frequencies and the AFs of the variants of the index (all tiers, tiers 1.1-2.5 and updated).
+class HaplotypeAnalysis(namedtuple('HaplotypeAnalysis', ['index', 'masks', 'frequencies', 'variants_freq_all',
+                                                         'variants_freq_gd', 'variants_freq_updated', 'thresholds'])):
+    __slots__ = ()
+
+    def mask(self, sheet):
+        return self.masks[SHEET_NAMES.index(sheet)]
+
+    def haplotypes(self, sheet='All_tiers'):
+        # {tag: [variant IDs]} of the haplotypes of a sheet
+        mask = self.mask(sheet)
+        rows, cols = self.index.rows[mask], self.index.cols[mask]
+        bounds = np.flatnonzero(np.r_[True, rows[1:] != rows[:-1], True]) if len(rows) else np.zeros(1, dtype=int)
+        return {tag: self.index.variants[cols[start:end]].tolist() for tag, start, end in
+                zip(self.index.tags[rows[bounds[:-1]]], bounds[:-1], bounds[1:])}
+
+    def tiers(self, sheet='All_tiers'):
+        # one row per tag and variant of a sheet with the tier of the variant on the tag
+        mask = self.mask(sheet)
+        return pd.DataFrame({'tag': self.index.tags[self.index.rows[mask]],
+                             'variant ID': self.index.variants[self.index.cols[mask]],
+                             'tier': self.index.tier_values[self.index.tier_codes[mask]]})
+
+    def sheets(self):
+        return haplotype_sheets(self.masks, self.variants_freq_all, self.variants_freq_gd, self.variants_freq_updated)
+
+    def summary(self):
+        return haplotype_summary(self.index, self.masks)
+
+    def write(self, outfile1, outfile2, outfile3, output_format='xlsx', concurrent=False):
+        write_outputs(outfile1, outfile2, outfile3, self.frequencies, self.index, self.sheets(), concurrent,
+                      output_format)
+
+
+def read_library(summary, frequency, dcs_bam=None, bam_processes=1, cache_dir=None, stage=no_profile):
+    # summary rows (read from the DCS BAM with a dcs_bam) and frequencies of a library, summary and frequency are
+    # files or DataFrames
+    with stage('read_frequencies') as record:
+        df_f = read_frequencies(frequency, cache_dir)
+        record.update(rows=len(df_f), variants=len(df_f))
+    if dcs_bam:
+        with stage('read_bam') as record:
+            df_s = read_dcs_bam(dcs_bam, df_f.index, bam_processes)
+            record.update(rows=len(df_s), variants=len(df_f))
+    else:
+        with stage('read_summary') as record:
+            df_s = read_summary(summary, cache_dir)
+            record.update(rows=len(df_s))
+    return df_s, df_f
+
+
+def load_library(summary, frequency, dcs_bam=None, bam_processes=1, same_molecule=True, cache_dir=None,
+                 stage=no_profile):
+    # tag index and frequencies of a library
+    df_s, df_f = read_library(summary, frequency, dcs_bam, bam_processes, cache_dir, stage)
+    with stage('tag_index') as record:
+        index = build_tag_index(df_s, same_molecule, stage)
+        record.update(rows=len(df_s), tags=len(index.tags), variants=len(index.variants))
+    return index, df_f
+
+
+def update_library(index, df_f, masks, filtered_occ, thresholds, stage=no_profile):
+    # the frequency update of a classified library and the analysis holding it
+    with stage('frequency_update') as record:
+        variants = pd.Index(index.variants)
+        variants_freq_all = df_f['AF (all tiers)'].reindex(variants).to_numpy()
+        variants_freq_gd = df_f['AF (tiers 1.1-2.5)'].reindex(variants).to_numpy()
+        # SNPS of switAF or higher are removed from the frequencies as well
+        df_new = update_frequencies(df_f, df_f.index[df_f['AF (tiers 1.1-2.5)'] >= thresholds.switAF], filtered_occ)
+        variants_freq_updated = df_new['AF (tiers 1.1-2.5)'].reindex(variants).to_numpy()
+        record.update(rows=len(df_new), variants=len(df_new))
+
+    return HaplotypeAnalysis(index, masks, df_new, variants_freq_all, variants_freq_gd, variants_freq_updated,
+                             thresholds)
+
+
+def classify_library(index, df_f, thresholds=DEFAULT_THRESHOLDS, stage=no_profile):
+    with stage('classification') as record:
+        variants_freq_gd = df_f['AF (tiers 1.1-2.5)'].reindex(pd.Index(index.variants)).to_numpy()
+        masks = classify_haplotypes(index, variants_freq_gd, thresholds)
+        filtered_occ = filtered_occurrences(index, masks[4])
+        record.update(rows=int(masks[0].sum()), tags=count_tags(index, masks[0]))
+    return update_library(index, df_f, masks, filtered_occ, thresholds, stage)
+
+
+def classify_library_sharded(df_s, df_f, thresholds=DEFAULT_THRESHOLDS, window=0, processes=1, same_molecule=True,
+                             stage=no_profile):
+    # the tag index is built and classified in shards of the summary rows, see classify_sharded
+    with stage('sharded_classification') as record:
+        index, masks, filtered_occ, shards = classify_sharded(df_s, df_f['AF (tiers 1.1-2.5)'], thresholds, window,
+                                                              processes, same_molecule)
+        record.update(rows=int(masks[0].sum()), tags=count_tags(index, masks[0]), variants=len(index.variants),
+                      shards=shards)
+    return update_library(index, df_f, masks, filtered_occ, thresholds, stage)
+
+
+def analyse(summary, frequency, thresholds=DEFAULT_THRESHOLDS, dcs_bam=None, bam_processes=1, shard_window=None,
+            shard_processes=1, same_molecule=True, cache_dir=None, stage=no_profile):
+    # Analysis of a library without writing any output: summary and frequency are files or DataFrames (summary may
+    # be None with a dcs_bam), the outputs can be written with HaplotypeAnalysis.write. With a shard_window the
+    # library is indexed and classified in shards (0 for one shard per chromosome) by shard_processes workers.
+    if shard_window is None:
+        index, df_f = load_library(summary, frequency, dcs_bam, bam_processes, same_molecule, cache_dir, stage)
+        return classify_library(index, df_f, thresholds, stage)
+    df_s, df_f = read_library(summary, frequency, dcs_bam, bam_processes, cache_dir, stage)
+    return classify_library_sharded(df_s, df_f, thresholds, shard_window, shard_processes, same_molecule, stage)
+
+
+def haplotype_analyser(argv, profiler=None):
+    parser = make_argparser()
+    args = parser.parse_args(argv[1:])
+    thresholds = Thresholds(args.switAF, args.goodTier, args.lowFreqAF, args.maxLowFreq)
+    if not args.SummaryFile and not args.DcsBam:
+        parser.error('one of --SummaryFile and --DcsBam is required')
+    if args.sweep and not args.sweepSummary:
+        parser.error('--sweep requires --sweepSummary')
+    if args.sweep and args.shardWindow is not None:
+        parser.error('--shardWindow cannot be combined with --sweep, which classifies one index of the library')
+    if profiler is None and args.profile:
+        profiler = StageProfiler()
+    stage = profiler.stage if profiler else no_profile
+
+    try:
+        if args.sweep:
+            index, df_f = load_library(args.SummaryFile, args.FreqFile, args.DcsBam, args.bamProcesses,
+                                       cache_dir=args.cacheDir, stage=stage)
+            with stage('sweep'):
+                sweep(index, df_f, read_sweep(args.sweep, thresholds), args.sweepSummary, args.concurrentOutput,
+                      args.outputFormat, stage)
+        else:
+            result = analyse(args.SummaryFile, args.FreqFile, thresholds, args.DcsBam, args.bamProcesses,
+                             args.shardWindow, args.shardProcesses, cache_dir=args.cacheDir, stage=stage)
+
+            with stage('sheet_writing') as record:
+                result.write(args.outputFile1, args.outputFile2, args.outputFile3, args.outputFormat,
+                             args.concurrentOutput)
+                all_tiers = result.masks[0]
+                record.update(rows=int(all_tiers.sum()), tags=count_tags(result.index, all_tiers),
+                              variants=len(np.unique(result.index.cols[all_tiers])))
+
+            if args.outputSummary:
+                with stage('haplotype_summary') as record:
+                    haplotypes, pairs = result.summary()
+                    write_haplotype_summary(args.outputSummary, haplotypes, pairs)
+                    record.update(rows=len(haplotypes), pairs=len(pairs))
+
+        if args.profile:
+            profiler.write(args.profile)
+    finally:
+        if profiler:
+            profiler.close()  # a profiler left tracing slows down everything else run in this process
 
 
 if __name__ == '__main__':
@@ -0,0 +1,182 @@
+#!/usr/bin/env python
+
+"""HaplotypeWorker.py
+Long-lived local worker for the haplotype analyser, which saves the interpreter start-up and the import of
+pandas/numpy/xlsxwriter/openpyxl for every job.
+serve   listens on a Unix socket and runs the jobs in a pool of warm worker processes. At most --processes jobs run
+        at the same time and --queue more wait, further jobs are refused as busy.
+submit  sends the options of HaplotypeAnalysisV1.py (relative paths are taken from the current directory) to the
+        worker and waits for the job. When no worker is running or it is busy, the analysis runs in this process.
+The socket is --socket or $HAPLOTYPE_WORKER_SOCKET, there is no shared default. Without a socket submit runs the
+analysis in this process.
+USAGE: export HAPLOTYPE_WORKER_SOCKET=~/haplotype_worker.sock
+       python HaplotypeWorker.py serve --processes 4 &
+       python HaplotypeWorker.py submit -s summary.xlsx -f frequency.xlsx --outputFile1 ... --outputFile2 ...
+"""
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stderr
+import argparse
+import importlib
+import io
+import json
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+import traceback
+
+# a worker is only used when a socket is given, so that a job never runs in the worker of another user or version
+DEFAULT_SOCKET = os.environ.get('HAPLOTYPE_WORKER_SOCKET') or None
+
+# modules imported once by the worker, the optional ones only if they are installed
+WARM_MODULES = ['HaplotypeAnalysisV1', 'openpyxl', 'pyarrow.parquet', 'scipy.sparse', 'pysam']
+
+
+def make_argparser():
+    parser = argparse.ArgumentParser(description='Runs haplotype analyser jobs in a long-lived local worker',
+                                     allow_abbrev=False)
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    serve = commands.add_parser('serve', help='Start the worker', allow_abbrev=False)
+    serve.add_argument('--socket', default=DEFAULT_SOCKET,
+                       help='Unix socket the worker listens on (default $HAPLOTYPE_WORKER_SOCKET)')
+    serve.add_argument('-p', '--processes', type=int, default=1, help='Number of jobs run at the same time')
+    serve.add_argument('-q', '--queue', type=int, default=8,
+                       help='Number of jobs waiting for a process, further jobs are refused as busy')
+
+    submit = commands.add_parser('submit', help='Run a job on the worker, all other options are those of '
+                                                'HaplotypeAnalysisV1.py', allow_abbrev=False)
+    submit.add_argument('--socket', default=DEFAULT_SOCKET,
+                        help='Unix socket of the worker (default $HAPLOTYPE_WORKER_SOCKET), without one the '
+                             'analysis runs in this process')
+
+    return parser
+
+
+def warm_up():
+    for module in WARM_MODULES:
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            pass
+
+
+def run_job(argv, cwd):
+    # runs in a worker process, one job at a time, so it can change into the directory of the client
+    from HaplotypeAnalysisV1 import haplotype_analyser
+
+    stderr = io.StringIO()
+    try:
+        os.chdir(cwd)
+        with redirect_stderr(stderr):
+            status = haplotype_analyser(['HaplotypeAnalysisV1.py'] + argv) or 0
+    except SystemExit as error:  # invalid options of the analysis, the usage is in stderr
+        status = error.code if isinstance(error.code, int) else 1
+    except Exception:
+        stderr.write(traceback.format_exc())
+        status = 1
+    return status, stderr.getvalue()
+
+
+class JobHandler(socketserver.StreamRequestHandler):
+    # one JSON request per connection: {"argv": [...], "cwd": "..."}, answered with {"status": ..., "stderr": ...}
+    def handle(self):
+        request = json.loads(self.rfile.readline())
+        if not self.server.slots.acquire(blocking=False):
+            self.reply({'status': 'busy'})
+            return
+        try:
+            status, stderr = self.server.executor.submit(run_job, request['argv'], request['cwd']).result()
+        except Exception:  # the worker process itself died
+            status, stderr = 1, traceback.format_exc()
+        finally:
+            self.server.slots.release()
+        self.reply({'status': status, 'stderr': stderr})
+
+    def reply(self, response):
+        self.wfile.write((json.dumps(response) + '\n').encode())
+
+
+class WorkerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path, processes, queue):
+        if os.path.exists(path):
+            if worker_running(path):
+                raise RuntimeError('a worker is already listening on {}'.format(path))
+            os.remove(path)  # left behind by a worker which did not shut down
+        super().__init__(path, JobHandler)
+        self.slots = threading.BoundedSemaphore(processes + queue)
+        self.executor = ProcessPoolExecutor(max_workers=processes, initializer=warm_up)
+        # start all worker processes now, before any job (and any thread of the server) exists
+        for future in [self.executor.submit(warm_up) for _ in range(processes)]:
+            future.result()
+
+    def server_close(self):
+        super().server_close()
+        self.executor.shutdown()
+        os.remove(self.server_address)
+
+
+def worker_running(path):
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as connection:
+            connection.connect(path)
+        return True
+    except OSError:
+        return False
+
+
+def serve(path, processes=1, queue=8):
+    warm_up()  # the worker processes are forked from a process which has imported everything
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))  # shut down cleanly, removing the socket
+    with WorkerServer(path, processes, queue) as server:
+        print('haplotype worker listening on {}'.format(path), file=sys.stderr, flush=True)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+def submit(path, argv):
+    # Runs a job on the worker, the result is None when it could not be run there (no worker or busy).
+    try:
+        connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        connection.connect(path)
+    except OSError:
+        connection.close()
+        return None
+    with connection, connection.makefile('rwb') as stream:
+        stream.write((json.dumps({'argv': argv, 'cwd': os.getcwd()}) + '\n').encode())
+        stream.flush()
+        response = json.loads(stream.readline() or '{"status": 1, "stderr": "the worker closed the connection\\n"}')
+    if response['status'] == 'busy':
+        return None
+    sys.stderr.write(response['stderr'])
+    return response['status']
+
+
+def worker(argv):
+    parser = make_argparser()
+    args, passthrough = parser.parse_known_args(argv[1:])
+    if args.command == 'serve':
+        if passthrough:
+            parser.error('unrecognized arguments: {}'.format(' '.join(passthrough)))
+        if not args.socket:
+            parser.error('serve requires --socket or $HAPLOTYPE_WORKER_SOCKET')
+        return serve(args.socket, args.processes, args.queue)
+
+    status = submit(args.socket, passthrough) if args.socket else None
+    if status is None:  # no worker (or a busy one), run the analysis in this process
+        if args.socket:
+            print('no haplotype worker available on {}, running the analysis in this process'.format(args.socket),
+                  file=sys.stderr, flush=True)
+        from HaplotypeAnalysisV1 import haplotype_analyser
+        status = haplotype_analyser(['HaplotypeAnalysisV1.py'] + passthrough)
+    return status
+
+
+if __name__ == '__main__':
+    sys.exit(worker(sys.argv))